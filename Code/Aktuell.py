@@ -1,12 +1,25 @@
 
+import os
 import sys
 import scipy.stats as stats
 import heapq
+import numpy as np
 from collections import defaultdict
 
 
 
-from Code.import_data import import_data
+from Code.import_data import import_data, GTFS_DIR
+from Code.gtfs_time import NO_TIME
+from Code.service_calendar import ServiceCalendar, shared_service_calendar
+from Code.day_cache import shared_day_timetable_cache
+from Code.label_search import label_setting_search, MIN_TRANSFER_TIME
+from Code.raptor import raptor_search, path_reliability
+from Code.mc_raptor import mc_raptor_search, mc_raptor_profile
+from Code.od_matrix import od_matrix
+from Code.backup_profile import BackupProfile
+from Code.search_pool import map_searches
+from Code.transfer_probability import transfer_probability_table
+from Code.delay_model import load_delay_model
 
 from datetime import datetime, timedelta
 
@@ -50,42 +63,6 @@ def is_service_available(service_id, date, calendar, calendar_dates):
 '''
 
 
-#correct and slow
-def is_service_available(service_id, start_time_obj, calendar, calendar_dates):
-    #date_str = date.strftime("%Y%m%d")
-    #date = date.date()
-    # Convert date to string in YYYYMMDD format
-    date_str = start_time_obj.strftime("%Y%m%d")
-    weekday = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"][start_time_obj.weekday()]
-
-    # Step 1: Check for exceptions in calendar_dates
-    if service_id in calendar_dates["service_id"].values:
-        exceptions = calendar_dates[calendar_dates["service_id"] == service_id]
-        for _, exception in exceptions.iterrows():
-            if exception["date"] == int(date_str):
-                if exception["exception_type"] == 2:  # Service is added as an exception
-                    return True
-                elif exception["exception_type"] == 1:  # Service is removed as an exception
-                    return False
-
-    # Step 2: Check for regular service in calendar
-    if service_id in calendar["service_id"].values:
-        service = calendar[calendar["service_id"] == service_id]
-        # Check if date is within start_date and end_date
-        if int(service["start_date"].iloc[0]) <= int(date_str) <= int(service["end_date"].iloc[0]):
-            # Check if the service operates on this weekday
-            #is_available = (service[weekday].iloc[0] == 1)
-            return True
-    return False
-
-def prepare_calendar_dates(calendar_dates):
-    grouped = calendar_dates.groupby("service_id")
-    calendar_dates_dict = {}
-    for service_id, group in grouped:
-        exceptions = group.to_dict(orient="records")
-        calendar_dates_dict[service_id] = exceptions
-    return calendar_dates_dict
-
 ######### Graph erstellen
 #Fast and weird
 '''
@@ -122,60 +99,18 @@ def create_graph_with_schedule(stop_times, stops, trips, calendar, calendar_date
 '''
 ##correct and slow
 
-def create_graph_with_schedule(stop_times, stops, trips, calendar, calendar_dates, date, time, end_time_obj):
+def create_graph_with_schedule(stop_times, stops, trips, calendar, calendar_dates, date, time, end_time_obj,
+                               service_calendar=None, gtfs_dir=GTFS_DIR):
 
-    graph = defaultdict(list)
-    stop_id_to_name = stops.set_index("stop_id")["stop_name"].to_dict()
-    # Filter for active trips today using is_service
-    trip_id_to_service = trips.set_index("trip_id")["service_id"].to_dict()
-    trip_id_to_route = trips.set_index("trip_id")["route_id"].to_dict()
+    # Service-Kalender einmal beim Laden berechnet, sonst einmal pro Tabellen
+    if service_calendar is None:
+        service_calendar = shared_service_calendar(calendar, calendar_dates)
 
-    calendar_dates_2 = prepare_calendar_dates(calendar_dates)
-    stop_times = stop_times.sort_values(by=["trip_id", "stop_sequence"])
-
-    #####
-    #Filter
-    #####
-
-    stop_times_copy = stop_times.copy()
-    # Filter out stops outside the time window
-    stop_times_copy["arrival_minutes"] = stop_times_copy["arrival_time"].apply(time_to_minutes)
-    stop_times_copy["departure_minutes"] = stop_times_copy["departure_time"].apply(time_to_minutes)
-
-    start_minutes = time_to_minutes(start_time_obj.strftime("%H:%M:%S"))
-    end_minutes = time_to_minutes(end_time_obj.strftime("%H:%M:%S"))
-
-    stop_times = stop_times_copy[
-        (stop_times_copy["arrival_minutes"] >= start_minutes) &
-        (stop_times_copy["departure_minutes"] <= end_minutes)
-        ]
-
-    print(f"Rows after time window filter: {len(stop_times)}")
-
-
-    #trip_id_to_service = trips.set_index("trip_id")["service_id"].to_dict()
-    stop_times["service_id"] = stop_times["trip_id"].map(trip_id_to_service)
-
-    grouped = stop_times.groupby("trip_id")
-    for trip_id, group in grouped:
-        service_id = trip_id_to_service[trip_id]
-        if not is_service_available(service_id, start_time_obj, calendar, calendar_dates): # TODO CHECK
-            continue
-        stops_in_trip = group["stop_id"].tolist()
-        arrival_times = group["arrival_time"].tolist()
-        departure_times = group["departure_time"].tolist()
-        for i in range(len(stops_in_trip) - 1):
-            start_stop_id = stops_in_trip[i]
-            end_stop_id = stops_in_trip[i + 1]
-            start_departure = time_to_minutes(departure_times[i])
-            end_arrival = time_to_minutes(arrival_times[i + 1])
-            travel_time = end_arrival - start_departure
-            if travel_time > 0:
-                start_stop_name = stop_id_to_name[start_stop_id]
-                end_stop_name = stop_id_to_name[end_stop_id]
-                route_id = trip_id_to_route[trip_id]
-                graph[start_stop_name].append((end_stop_name, start_departure, end_arrival, route_id))
-    return graph
+    # Fahrplan des ganzen Betriebstags aus dem gemeinsamen Cache: gebaut wird nur einmal pro Verkehrstagemuster
+    # (alle Tage mit denselben aktiven Services teilen sich einen Eintrag). Startzeit und Zeitbudget (time bis
+    # end_time_obj) schränken die Suchen selbst ein. Ohne stop_times werden nur die Zeilen der aktiven Fahrten
+    # aus stop_times.txt von gtfs_dir gestreamt (load_stop_times), die volle Tabelle wird nie geladen.
+    return shared_day_timetable_cache(stop_times, stops, trips, service_calendar, gtfs_dir=gtfs_dir).get(date)
 '''
 #new try denis V1
 def create_graph_with_schedule(stop_times, stops, trips, calendar, calendar_dates, date, time, end_time_obj):
@@ -274,64 +209,172 @@ def compute_transfer_probability_with_departure_delay(scheduled_arrival, schedul
     return norm.cdf(0, loc=mu_departure - mu_arrival, scale=std_dev_diff)
 '''
 
+# Umstiegswahrscheinlichkeit als Tabelle pro Sekunde Umstiegszeit (Gamma-CDF a=2, scale=3 Minuten), von allen Suchen geteilt
+TRANSFER_PROBABILITY = transfer_probability_table(shape=2, scale_minutes=3)
+
+# Umstiegskurven pro ankommender Linie, abfahrender Linie, Haltestelle und Stunde (fit_delay_model mit historischen
+# Verspätungen). Liegt ein Modell im Ordner, rechnen die Suchen damit, Umstiege ohne Kurve mit TRANSFER_PROBABILITY
+# (travel_time_matrix bleibt bei TRANSFER_PROBABILITY, die Worker-Prozesse bekommen nur die Tabelle)
+DELAY_MODEL_DIR = os.path.join(GTFS_DIR, "delay_model")
+DELAY_MODEL = load_delay_model(DELAY_MODEL_DIR, fallback=TRANSFER_PROBABILITY)
+
+
 def compute_transfer_probability_with_departure_delay(transfer_time):
     #transfer_window = departure_time - scheduled_arrival
     #if transfer_window < 0:
     #    return 0.1  # No chance of a successful transfer if arrival is after departure
-    return stats.gamma.cdf(transfer_time, a=2, scale=3)
+    return TRANSFER_PROBABILITY(transfer_time * 60)
 
 
 
 # Dijkstra mit Backup-Routenberechnung
 def dijkstra_with_reliability_fixed(graph, start_name, end_name, start_time_minutes, time_budget_minutes,
                                     exclude_routes=set()):
-    pq = [(start_time_minutes, start_name, [], 1.0,
-           None)]  # (aktuelle Zeit, aktuelle Haltestelle, Pfad, Zuverlässigkeit, letzte Linie)
-    visited = set()
-    MIN_TRANSFER_TIME = 5  # Mindestumstiegszeit in Minuten
-
-    while pq:
-        current_time, current_stop, path, reliability, last_route = heapq.heappop(pq)
-
-        if (current_stop, current_time) in visited:
-            continue
-        visited.add((current_stop, current_time))
-
-        path = path + [(current_stop, current_time)]
-
-        if current_time - start_time_minutes > time_budget_minutes:
-            continue  # Pruning: Abbruch, wenn Zeitbudget überschritten
-
-        for neighbor, departure_time, arrival_time, route_id in graph[current_stop]:
-            if departure_time >= current_time and route_id not in exclude_routes:
-                # Prüfe, ob es ein Umstieg ist (Linienwechsel)
-                is_transfer = last_route is not None and last_route != route_id
-                if is_transfer:
-                    # Mindestumstiegszeit von 5 Minuten nur bei Umstiegen
-                    transfer_time = departure_time - current_time
-                    if transfer_time < MIN_TRANSFER_TIME:
-                        continue  # Pruning: Zu wenig Zeit für Umstieg
-
-                # Berechne neue Zuverlässigkeit mit Transferwahrscheinlichkeit
-                if not is_transfer:  # Keine Zuverlässigkeitsänderung bei gleicher Linie
-                    transfer_reliability = 1.0
-                else:
-                    transfer_reliability = compute_transfer_probability_with_departure_delay(transfer_time)
-
-                new_current_time = arrival_time
-                new_reliability = reliability * transfer_reliability
+    # Label-setting Suche: pro Haltestelle und ankommender Linie nur nicht-dominierte (Zeit, Zuverlässigkeit) Labels
+    return run_search(label_setting_search, graph, start_name, end_name, start_time_minutes, time_budget_minutes,
+                      exclude_routes)
+
+
+# RAPTOR: gleiche Ein- und Ausgabe wie dijkstra_with_reliability_fixed, rundenbasiert ohne Prioritätswarteschlange
+def raptor_with_reliability(graph, start_name, end_name, start_time_minutes, time_budget_minutes,
+                            exclude_routes=set()):
+    return run_search(raptor_search, graph, start_name, end_name, start_time_minutes, time_budget_minutes,
+                      exclude_routes)
+
+
+# Transfer Patterns: nur die vorberechneten Umstiegsfolgen (build_transfer_patterns) werden mit dem Fahrplan des Tages ausgewertet
+def transfer_pattern_route(graph, pattern_index, start_name, end_name, start_time_minutes, time_budget_minutes,
+                           exclude_routes=set()):
+    return run_search(pattern_index.search, graph, start_name, end_name, start_time_minutes, time_budget_minutes,
+                      exclude_routes)
+
+
+# Pareto-Front über (Ankunft, Zuverlässigkeit, Anzahl Fahrten) in einem Lauf (McRAPTOR)
+def pareto_routes(graph, start_name, end_name, start_time_minutes, time_budget_minutes, exclude_routes=set()):
+    query = query_to_indices(graph, start_name, end_name, start_time_minutes, time_budget_minutes, exclude_routes)
+    if query is None:
+        return []
+    journeys = mc_raptor_search(graph, *query, transfer_probability=transfer_probability_seconds,
+                                min_transfer_time=MIN_TRANSFER_TIME, delay_model=DELAY_MODEL)
+    # (Ankunft in Minuten, Pfad, Zuverlässigkeit, Anzahl Umstiege)
+    return [(arrival_time / 60, path_to_names(graph, path), reliability, trips - 1)
+            for arrival_time, reliability, trips, path, _ in journeys]
+
+
+# Zuverlässigste Route innerhalb des Zeitbudgets, direkt aus der Pareto-Front abgelesen
+def most_reliable_route(graph, start_name, end_name, start_time_minutes, time_budget_minutes, exclude_routes=set()):
+    front = pareto_routes(graph, start_name, end_name, start_time_minutes, time_budget_minutes, exclude_routes)
+    if not front:
+        return float("inf"), [], 0.0
+    arrival_time, path, reliability, _ = max(front, key=lambda journey: (journey[2], -journey[0]))
+    return arrival_time, path, reliability
+
+
+# Profil-Anfrage: Pareto-Front für jede Abfahrt im Zeitfenster in einem Durchlauf (statt einer Suche pro Startminute)
+# Der Graph muss das Fenster plus Zeitbudget abdecken (der Fahrplan von create_graph_with_schedule umfasst den ganzen Betriebstag)
+def departure_profile(graph, start_name, end_name, window_start_minutes, window_end_minutes, time_budget_minutes,
+                      exclude_routes=set()):
+    query = query_to_indices(graph, start_name, end_name, window_start_minutes, time_budget_minutes, exclude_routes)
+    if query is None:
+        return []
+    start_stop, end_stop, window_start, time_budget, excluded = query
+    profile = mc_raptor_profile(graph, start_stop, end_stop, window_start, round(window_end_minutes * 60),
+                                time_budget, excluded, transfer_probability=transfer_probability_seconds,
+                                min_transfer_time=MIN_TRANSFER_TIME, delay_model=DELAY_MODEL)
+    # (Abfahrt in Minuten, [(Ankunft in Minuten, Pfad, Zuverlässigkeit, Anzahl Umstiege)])
+    return [(departure / 60, [(arrival_time / 60, path_to_names(graph, path), reliability, trips - 1)
+                              for arrival_time, reliability, trips, path, _ in journeys])
+            for departure, journeys in profile]
+
+
+# Abfahrt mit der zuverlässigsten Route im Zeitfenster (bei Gleichstand die spätere Abfahrt)
+def most_reliable_departure(graph, start_name, end_name, window_start_minutes, window_end_minutes,
+                            time_budget_minutes, exclude_routes=set()):
+    profile = departure_profile(graph, start_name, end_name, window_start_minutes, window_end_minutes,
+                                time_budget_minutes, exclude_routes)
+    if not profile:
+        return None, float("inf"), [], 0.0
+    departure, (arrival_time, path, reliability, _) = max(
+        ((departure, journey) for departure, journeys in profile for journey in journeys),
+        key=lambda entry: (entry[1][2], entry[0], -entry[1][0]))
+    return departure, arrival_time, path, reliability
+
+
+# OD-Matrizen (früheste Ankunft in Minuten, Zuverlässigkeit) zwischen vielen Haltestellen: ein One-to-all Lauf pro Start,
+# die Starts werden auf alle Kerne verteilt. Unbekannte oder unerreichbare Paare: Ankunft nan, Zuverlässigkeit 0
+def travel_time_matrix(graph, origin_names, destination_names, start_time_minutes, time_budget_minutes,
+                       exclude_routes=set(), workers=None):
+    origins = [name for name in origin_names if name in graph.stop_index]
+    destinations = [name for name in destination_names if name in graph.stop_index]
+    arrival_minutes = np.full((len(origin_names), len(destination_names)), np.nan)
+    reliabilities = np.zeros((len(origin_names), len(destination_names)))
+    if not origins or not destinations:
+        return arrival_minutes, reliabilities
+
+    arrivals, reliability = od_matrix(graph, [graph.stop_index[name] for name in origins],
+                                      [graph.stop_index[name] for name in destinations],
+                                      round(start_time_minutes * 60), time_budget_minutes * 60,
+                                      graph.route_codes(exclude_routes), transfer_probability_seconds,
+                                      min_transfer_time=MIN_TRANSFER_TIME, workers=workers)
+    rows = [i for i, name in enumerate(origin_names) if name in graph.stop_index]
+    columns = [j for j, name in enumerate(destination_names) if name in graph.stop_index]
+    arrival_minutes[np.ix_(rows, columns)] = np.where(arrivals == NO_TIME, np.nan, arrivals / 60)
+    reliabilities[np.ix_(rows, columns)] = reliability
+    return arrival_minutes, reliabilities
+
+
+def query_to_indices(graph, start_name, end_name, start_time_minutes, time_budget_minutes, exclude_routes):
+    # Namen nur an der Schnittstelle: intern wird mit Haltestellen- und Linienindizes gerechnet
+    if start_name not in graph.stop_index or end_name not in graph.stop_index:
+        return None
+    # Intern wird nur mit ganzzahligen Sekunden seit Betriebstagbeginn gerechnet
+    return (graph.stop_index[start_name], graph.stop_index[end_name], round(start_time_minutes * 60),
+            time_budget_minutes * 60, graph.route_codes(exclude_routes))
+
+
+def transfer_probability_seconds(transfer_time):
+    return TRANSFER_PROBABILITY(transfer_time)
+
+
+def run_search(search, graph, start_name, end_name, start_time_minutes, time_budget_minutes, exclude_routes):
+    query = query_to_indices(graph, start_name, end_name, start_time_minutes, time_budget_minutes, exclude_routes)
+    if query is None:
+        return float("inf"), [], 0.0
+    arrival_time, path, reliability = search(graph, *query, transfer_probability=transfer_probability_seconds,
+                                             min_transfer_time=MIN_TRANSFER_TIME, delay_model=DELAY_MODEL)
+    if not path:
+        return float("inf"), [], 0.0  # Keine Route gefunden
+    return arrival_time / 60, path_to_names(graph, path), reliability
+
+
+def path_to_names(graph, path):
+    # Übersetzt einen Pfad mit Indizes und Sekunden zurück in Haltestellennamen, Linien-IDs und Minuten
+    named_path = []
+    for segment in path:
+        if len(segment) == 2:
+            stop, time = segment
+            named_path.append((graph.stop_names[stop], time / 60))
+        else:
+            route, departure_time, arrival_time = segment
+            named_path.append((graph.route_ids[route], departure_time / 60, arrival_time / 60))
+    return named_path
 
-                heapq.heappush(pq, (
-                    new_current_time, neighbor, path + [(route_id, departure_time, arrival_time)], new_reliability,
-                    route_id))
 
-        if current_stop == end_name:
-            return current_time, path, reliability
+# Backup-Routen finden (eine Rückwärts-Profilsuche vom Ziel, ohne Primärroute)
 
-    return float("inf"), [], 0.0  # Keine Route gefunden
+# Profil aller frühesten Ankünfte am Ziel innerhalb des Zeitbudgets der Reise
+def backup_profile(graph, end_name, start_time_minutes, time_budget_minutes, exclude_routes=set()):
+    return BackupProfile(graph, graph.stop_index[end_name], round(start_time_minutes * 60),
+                         round((start_time_minutes + time_budget_minutes) * 60), graph.route_codes(exclude_routes),
+                         min_transfer_time=MIN_TRANSFER_TIME)
 
 
-# Backup-Routen finden (Dijkstra an jeder Umstiegshaltestelle, ohne Primärroute)
+# Früheste Route ab einer Haltestelle und Uhrzeit aus dem Profil, gleiche Ausgabe wie dijkstra_with_reliability_fixed
+def profile_backup_route(graph, profile, start_name, start_time_minutes):
+    arrival_time, path = profile.journey(graph.stop_index[start_name], round(start_time_minutes * 60))
+    if not path:
+        return float("inf"), [], 0.0
+    return arrival_time / 60, path_to_names(graph, path), path_reliability(path, transfer_probability_seconds, DELAY_MODEL, graph)
 
 '''
 def find_backup_routes(djikstra_route, graph,)
@@ -352,38 +395,68 @@ go back to main
 
 def find_backup_routes(graph, primary_path, start_time_minutes, time_budget_minutes):
     backup_routes = []
+    if not primary_path or primary_path[-1][0] not in graph:
+        return backup_routes
     used_routes = {segment[0] for segment in primary_path if isinstance(segment, tuple) and len(segment) == 3}
 
+    # Eine Rückwärts-Profilsuche vom Ziel ohne die Linien der Primärroute (statt einer Dijkstra-Suche pro
+    # Umstiegspunkt), das Backup jedes Umstiegspunkts ist danach nur noch ein Nachschlagen im Profil
+    profile = backup_profile(graph, primary_path[-1][0], start_time_minutes, time_budget_minutes, used_routes)
+
     for i in range(1, len(primary_path) - 1, 2):  # Alle Umstiegspunkte durchgehen
         transfer_stop, transfer_time = primary_path[i - 1]
 
         if transfer_stop in graph:
-            backup_time, backup_path, backup_reliability = dijkstra_with_reliability_fixed(
-                graph, transfer_stop, primary_path[-1][0], transfer_time, time_budget_minutes, used_routes
-            )
-
-            if backup_time < float("inf") and backup_path and backup_path != primary_path:
-                alternative_path = []
-                alternative_routes = set()
-
-                for j in range(1, len(backup_path) - 1, 2):
-                    stop1, time1 = backup_path[j - 1]
-                    route, dep, arr = backup_path[j]
-                    stop2, _ = backup_path[j + 1]
-
-                    # **Kriterium für alternative Backup-Route:**
-                    # - Die Route darf nicht exakt der Primärroute entsprechen.
-                    # - Die Haltestellen dürfen wiederverwendet werden, aber nicht in identischen Abschnitten.
-                    if route not in used_routes:
-                        alternative_path.append((stop1, minutes_to_time(dep), stop2, minutes_to_time(arr), route))
-                        alternative_routes.add(route)
-
-                if alternative_path:
-                    backup_routes.append((transfer_stop, alternative_path, backup_reliability))
-                    used_routes.update(alternative_routes)  # Speichere die genutzten alternativen Linien
+            backup_time, backup_path, backup_reliability = profile_backup_route(graph, profile, transfer_stop,
+                                                                                transfer_time)
+
+            backup_route = to_backup_route(transfer_stop, primary_path, backup_time, backup_path, backup_reliability)
+            if backup_route:
+                backup_routes.append(backup_route)
 
     return backup_routes  # Gibt jetzt echte alternative Backup-Routen zurück
 
+
+# Backup-Routen mit einer eigenen Dijkstra-Suche pro Umstiegspunkt (Zeitbudget ab der Umstiegszeit). Die Suchen sind
+# bei gegebener Primärroute unabhängig und laufen parallel in Prozessen, die den Graphen per fork copy-on-write teilen
+def find_backup_routes_per_transfer(graph, primary_path, start_time_minutes, time_budget_minutes, workers=None):
+    if not primary_path:
+        return []
+    used_routes = {segment[0] for segment in primary_path if isinstance(segment, tuple) and len(segment) == 3}
+    transfer_points = [primary_path[i - 1] for i in range(1, len(primary_path) - 1, 2) if primary_path[i - 1][0] in graph]
+    jobs = [(transfer_stop, primary_path[-1][0], transfer_time, time_budget_minutes, used_routes)
+            for transfer_stop, transfer_time in transfer_points]
+
+    # Ergebnisse in der Reihenfolge der Umstiegspunkte (deterministisch, unabhängig von den Prozessen)
+    backup_routes = []
+    for (transfer_stop, _), backup in zip(transfer_points, map_searches(dijkstra_with_reliability_fixed, graph, jobs,
+                                                                        workers)):
+        backup_route = to_backup_route(transfer_stop, primary_path, *backup)
+        if backup_route:
+            backup_routes.append(backup_route)
+    return backup_routes
+
+
+def to_backup_route(transfer_stop, primary_path, backup_time, backup_path, backup_reliability):
+    # Ausgabeformat der Backup-Routen: (Umstiegshaltestelle, [(von, Abfahrt, nach, Ankunft, Linie)], Zuverlässigkeit)
+    if backup_time == float("inf") or not backup_path or backup_path == primary_path:
+        return None
+    alternative_path = []
+
+    # **Kriterium für alternative Backup-Route:**
+    # - Die Linien der Primärroute sind in der Suche ausgeschlossen.
+    # - Die Haltestellen dürfen wiederverwendet werden, aber nicht in identischen Abschnitten.
+    for j in range(1, len(backup_path) - 1, 2):
+        stop1, time1 = backup_path[j - 1]
+        route, dep, arr = backup_path[j]
+        stop2, _ = backup_path[j + 1]
+        alternative_path.append((stop1, minutes_to_time(dep), stop2, minutes_to_time(arr), route))
+
+    if not alternative_path:
+        return None
+    return transfer_stop, alternative_path, backup_reliability
+
+
 # TODO Only exlude route before transfer and one after
 # TODO search for mreliable
 # TODO Backup rout would start at leats at departure time of missed connection
@@ -392,7 +465,13 @@ def find_backup_routes(graph, primary_path, start_time_minutes, time_budget_minu
 # Hauptprogramm
 if __name__ == "__main__":
 
-    agency, stops, routes, trips, stop_times, calendar, calendar_dates = import_data()
+    # stop_times werden nicht geladen, sondern beim Bau des Fahrplans gestreamt (nur die aktiven Fahrten)
+    agency, stops, routes, trips, calendar, calendar_dates = import_data(
+        tables=["agency", "stops", "routes", "trips", "calendar", "calendar_dates"])
+    stop_times = None
+
+    # Service-Kalender einmal beim Laden berechnen
+    service_calendar = ServiceCalendar(calendar, calendar_dates)
 
     start_stop_name = "Schattendorf Kirchengasse"
     end_stop_name = "Flughafen Wien Bahnhof"
@@ -417,7 +496,7 @@ if __name__ == "__main__":
 
     #slow and correct
     graph = create_graph_with_schedule(stop_times, stops, trips, calendar, calendar_dates, start_time_obj,
-                                       start_time_obj, end_time_obj)
+                                       start_time_obj, end_time_obj, service_calendar=service_calendar)
     if start_stop_name not in graph or end_stop_name not in graph:
         print("🚨 Ungültige Start- oder Zielhaltestelle!")
         #sys.exit()
@@ -0,0 +1,154 @@
+from bisect import bisect_right
+
+import numpy as np
+
+from Code.label_search import MIN_TRANSFER_TIME, NO_ROUTE
+
+'''
+Backward profile search to one destination (profile connection scan).
+
+The connections of a Timetable are scanned once by decreasing departure time. For every
+connection the earliest arrival at the destination is known when it is reached, because all
+connections it can lead to depart later: stay in the trip, get off at the destination, or
+transfer to the profile of the arrival stop. Every stop keeps a profile of
+(departure, arrival at destination, route, connection) entries. An entry is dropped if another
+entry departing no earlier arrives no later and can be used whenever it can, i.e. it has the
+same route or departs at least the minimum transfer time later.
+
+After the scan the best journey from any stop at any time is a lookup in the profile of the
+stop, so the backups of all transfer points of a primary route need one search instead of one
+search per transfer point.
+'''
+
+INFINITY = float("inf")
+
+# Decisions at the end of a connection
+END, STAY, TRANSFER = 0, 1, 2
+
+
+class BackupProfile:
+    """
+    Earliest arrival at one destination from every stop and time within a time window.
+
+    Attributes:
+    - end_stop (int): Stop index of the destination.
+    - latest_arrival (int): Latest arrival at the destination in seconds.
+    - min_transfer_time (int): Minimum time in seconds for a change between two routes.
+    - entries (dict): Stop -> profile entries (departure, arrival, route, connection), by decreasing departure.
+    """
+
+    def __init__(self, timetable, end_stop: int, earliest_departure: int, latest_arrival: int,
+                 excluded=frozenset(), min_transfer_time: int = MIN_TRANSFER_TIME):
+        self.end_stop = end_stop
+        self.latest_arrival = latest_arrival
+        self.min_transfer_time = min_transfer_time
+        self.entries = {}
+        self._negative_departures = {}  # Stop -> -departure of the entries (ascending, for bisection)
+
+        # Connections within the window, by decreasing departure
+        source = np.repeat(np.arange(timetable.n_stops, dtype=np.int32), np.diff(timetable.offsets))
+        mask = (timetable.dep >= earliest_departure) & (timetable.arr <= latest_arrival)
+        if excluded:
+            mask &= ~np.isin(timetable.route, list(excluded))
+        selected = np.flatnonzero(mask)
+        selected = selected[np.argsort(-timetable.dep[selected], kind="stable")]
+        self.source = source[selected].tolist()
+        self.target = timetable.target[selected].tolist()
+        self.dep = timetable.dep[selected].tolist()
+        self.arr = timetable.arr[selected].tolist()
+        self.route = timetable.route[selected].tolist()
+        trip = timetable.trip[selected].tolist()
+
+        # Decision at the end of every connection: (END, None), (STAY, next connection) or (TRANSFER, connection)
+        self.decision = [None] * len(selected)
+        trip_best = {}  # trip -> (arrival at destination, connection) when travelling on the trip
+        for c in range(len(selected)):
+            best, decision = INFINITY, None
+            if self.target[c] == end_stop:
+                best, decision = self.arr[c], (END, None)
+            if trip[c] in trip_best and trip_best[trip[c]][0] < best:
+                best, decision = trip_best[trip[c]][0], (STAY, trip_best[trip[c]][1])
+            entry = self.best_entry(self.target[c], self.arr[c], self.route[c])
+            if entry is not None and entry[1] < best:
+                best, decision = entry[1], (TRANSFER, entry[3])
+            if decision is None:
+                continue
+            self.decision[c] = decision
+            trip_best[trip[c]] = (best, c)
+            self.add_entry(self.source[c], (self.dep[c], best, self.route[c], c))
+
+    def add_entry(self, stop: int, entry: tuple):
+        # Appends the entry unless an entry departing no earlier dominates it
+        entries = self.entries.setdefault(stop, [])
+        departure, arrival, route, _ = entry
+        first_any = None  # Departure of the first entry usable without regard to the route
+        for other_departure, other_arrival, other_route, _ in reversed(entries):
+            if first_any is not None and other_departure >= first_any + self.min_transfer_time:
+                break  # No later entry can arrive earlier than the ones already seen
+            if other_departure >= departure + self.min_transfer_time:
+                if first_any is None:
+                    first_any = other_departure
+                if other_arrival <= arrival:
+                    return
+            elif other_route == route and other_arrival <= arrival:
+                return
+        entries.append(entry)
+        self._negative_departures.setdefault(stop, []).append(-departure)
+
+    def best_entry(self, stop: int, time: int, route: int = NO_ROUTE):
+        """
+        Best profile entry of a stop for a traveller who is there at a given time.
+
+        Parameters:
+        - stop (int): Stop index.
+        - time (int): Time at the stop in seconds.
+        - route (int): Route the stop was reached with (NO_ROUTE at the start of a journey, no transfer time).
+
+        Returns:
+        - (tuple): (departure, arrival, route, connection) with the earliest arrival, None if there is none.
+        """
+        if stop not in self.entries:
+            return None
+        entries = self.entries[stop]
+        ready = time if route == NO_ROUTE else time + self.min_transfer_time
+        best, first_any = None, None
+        # Entries departing at or after time, from the earliest departure on
+        for i in range(bisect_right(self._negative_departures[stop], -time) - 1, -1, -1):
+            entry = entries[i]
+            if first_any is not None and entry[0] >= first_any + self.min_transfer_time:
+                break  # No later entry can arrive earlier than the ones already seen
+            if entry[0] >= ready:
+                if first_any is None:
+                    first_any = entry[0]
+            elif entry[2] != route:
+                continue  # A transfer would be too short
+            if best is None or entry[1] < best[1]:
+                best = entry
+        return best
+
+    def journey(self, stop: int, time: int, route: int = NO_ROUTE) -> tuple:
+        """
+        Earliest journey from a stop at a given time to the destination.
+
+        Parameters:
+        - stop (int): Stop index.
+        - time (int): Time at the stop in seconds.
+        - route (int): Route the stop was reached with (NO_ROUTE: no transfer time needed).
+
+        Returns:
+        - tuple: (arrival time, path) with the path as alternating (stop, time) and (route, departure, arrival)
+          tuples, (inf, []) if the destination cannot be reached.
+        """
+        if stop == self.end_stop:
+            return time, [(stop, time)]
+        entry = self.best_entry(stop, time, route)
+        if entry is None:
+            return INFINITY, []
+        path = [(stop, time)]
+        c = entry[3]
+        while True:
+            path.append((self.route[c], self.dep[c], self.arr[c]))
+            path.append((self.target[c], self.arr[c]))
+            kind, c = self.decision[c]
+            if kind == END:
+                return entry[1], path
@@ -0,0 +1,145 @@
+from bisect import bisect_left
+
+import numpy as np
+
+from Code.label_search import MIN_TRANSFER_TIME
+from Code.timetable import intern
+
+'''
+Connection Scan Algorithm (CSA) on the leg list of prepare_data.
+
+A leg is a tuple (trip_id, departure_node, departure_time, arrival_node, arrival_time, route_id,
+service_id). The legs are sorted once by departure time into flat arrays; an earliest arrival
+query is a single linear scan starting at the first leg departing after the start time and
+stopping as soon as no later leg can improve the arrival at the destination.
+'''
+
+INFINITY = float("inf")
+NO_CONNECTION = -1
+
+
+class ConnectionScan:
+    """
+    Legs sorted by departure time, with interned stops, trips and services.
+
+    Attributes:
+    - legs (list): The leg tuples in scan order.
+    - stop_index (dict): Node name -> stop index.
+    - departure_stop, arrival_stop, departure_time, arrival_time, trip, service (list):
+      Per connection in scan order.
+    - next_in_trip (list): Next connection of the same trip (NO_CONNECTION for the last one).
+    """
+
+    def __init__(self, legs):
+        legs = list(legs)
+        departure_times = np.array([leg[2] for leg in legs], dtype=np.int64)
+        order = np.argsort(departure_times, kind="stable")
+        self.legs = [legs[i] for i in order]
+
+        stop_codes, stop_names = intern([leg[1] for leg in self.legs] + [leg[3] for leg in self.legs])
+        trip_codes, self.trip_ids = intern([leg[0] for leg in self.legs])
+        service_codes, self.service_ids = intern([leg[6] for leg in self.legs])
+        self.stop_names = stop_names
+        self.stop_index = {name: i for i, name in enumerate(stop_names)}
+        self.service_index = {service_id: i for i, service_id in enumerate(self.service_ids)}
+
+        n = len(self.legs)
+        self.departure_stop = stop_codes[:n].tolist()
+        self.arrival_stop = stop_codes[n:].tolist()
+        self.departure_time = departure_times[order].tolist()
+        self.arrival_time = [leg[4] for leg in self.legs]
+        self.trip = trip_codes.tolist()
+        self.service = service_codes.tolist()
+
+        # Chain the connections of every trip in departure order for the journey reconstruction
+        self.next_in_trip = [NO_CONNECTION] * n
+        by_trip = np.lexsort((np.arange(n), trip_codes))
+        for a, b in zip(by_trip[:-1].tolist(), by_trip[1:].tolist()):
+            if self.trip[a] == self.trip[b]:
+                self.next_in_trip[a] = b
+
+    def __len__(self) -> int:
+        return len(self.legs)
+
+    def earliest_arrival(self, origin, destination, start_time: int, time_budget: int = None,
+                         active_services=None, min_transfer_time: int = MIN_TRANSFER_TIME) -> tuple:
+        """
+        Earliest arrival query with a single scan over the connections.
+
+        Parameters:
+        - origin, destination (str): Departure and arrival node.
+        - start_time (int): Earliest departure at the origin (seconds since the start of the service day).
+        - time_budget (int, optional): Maximum travel time in seconds.
+        - active_services (iterable, optional): Only legs of these service_ids are used.
+        - min_transfer_time (int): Minimum time in seconds for a change between two trips.
+
+        Returns:
+        - tuple: (arrival_time, itinerary) with the itinerary as list of legs, (None, []) if the
+          destination cannot be reached.
+        """
+        if origin not in self.stop_index or destination not in self.stop_index:
+            return None, []
+        source = self.stop_index[origin]
+        target = self.stop_index[destination]
+        if source == target:
+            return start_time, []
+
+        service_active = None
+        if active_services is not None:
+            service_active = [False] * len(self.service_ids)
+            for service_id in active_services:
+                if service_id in self.service_index:
+                    service_active[self.service_index[service_id]] = True
+
+        latest_arrival = INFINITY if time_budget is None else start_time + time_budget
+        earliest = {source: start_time}  # stop -> earliest arrival
+        reached_by = {}  # stop -> (connection boarding the trip, connection arriving at the stop)
+        boarded = {}  # trip -> connection at which the trip was boarded
+
+        departure_stop, arrival_stop = self.departure_stop, self.arrival_stop
+        departure_time, arrival_time = self.departure_time, self.arrival_time
+        trip, service = self.trip, self.service
+
+        for c in range(bisect_left(departure_time, start_time), len(departure_time)):
+            if departure_time[c] >= earliest.get(target, latest_arrival):
+                break  # no later connection can arrive earlier
+            if service_active is not None and not service_active[service[c]]:
+                continue
+
+            t = trip[c]
+            if t not in boarded:
+                # Board the trip if the departure stop is reached in time (transfer time after a ride)
+                stop = departure_stop[c]
+                if stop not in earliest:
+                    continue
+                ready = earliest[stop] if stop == source else earliest[stop] + min_transfer_time
+                if departure_time[c] < ready:
+                    continue
+                boarded[t] = c
+
+            stop = arrival_stop[c]
+            if arrival_time[c] < earliest.get(stop, INFINITY) and arrival_time[c] <= latest_arrival:
+                earliest[stop] = arrival_time[c]
+                reached_by[stop] = (boarded[t], c)
+
+        if target not in reached_by:
+            return None, []
+        return earliest[target], self.journey(reached_by, source, target)
+
+    def journey(self, reached_by: dict, source: int, target: int) -> list:
+        # Follows the (boarding, alighting) pointers back to the origin and expands every trip into its legs
+        rides = []
+        stop = target
+        while stop != source:
+            enter, exit_ = reached_by[stop]
+            rides.append((enter, exit_))
+            stop = self.departure_stop[enter]
+        itinerary = []
+        for enter, exit_ in reversed(rides):
+            c = enter
+            while True:
+                itinerary.append(self.legs[c])
+                if c == exit_:
+                    break
+                c = self.next_in_trip[c]
+        return itinerary
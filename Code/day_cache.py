@@ -0,0 +1,173 @@
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+
+from Code.import_data import GTFS_DIR, load_stop_times
+from Code.timetable import build_timetable_from_stop_times
+
+'''
+Cache of built day timetables for long-running processes.
+
+A timetable of one service day only depends on the set of services running that day, so the
+cache key is the service pattern of the day (the column of the ServiceCalendar matrix), not the
+calendar date. All days of one day type (e.g. every regular weekday of a period) share one entry
+and the timetable is built once per distinct pattern. Entries cover the whole service day, the
+search restricts the time itself (start time and time budget).
+
+Without a stop_times DataFrame the cache streams the stop times of the active trips from
+stop_times.txt on every miss (load_stop_times), so the full table is never held in memory.
+
+The cache holds at most max_bytes of timetable arrays, the least recently used entries are
+evicted first. shared_day_timetable_cache returns one cache per feed, so every graph build of a
+process (create_graph_with_schedule in Aktuell.py) goes through the same entries.
+'''
+
+# Default memory cap for the cached timetables (bytes)
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+
+
+class DayTimetableCache:
+    """
+    LRU cache of full-day Timetables keyed by the active services of the day.
+
+    Attributes:
+    - max_bytes (int): Memory cap for the cached timetable arrays.
+    - gtfs_dir (str): Feed the stop times are streamed from if no stop_times DataFrame is given.
+    - hits, misses, evictions (int): Statistics since creation (or the last clear()).
+    """
+
+    def __init__(self, stop_times, stops, trips, service_calendar, max_bytes: int = DEFAULT_MAX_BYTES,
+                 gtfs_dir: str = GTFS_DIR):
+        self.stop_times = stop_times
+        self.stops = stops
+        self.trips = trips
+        self.gtfs_dir = gtfs_dir
+        if stop_times is None:
+            # Streamed stop times carry the ids as strings, the lookups must use the same type
+            self.stops = stops.assign(stop_id=stops["stop_id"].astype(str))
+            self.trips = trips.assign(trip_id=trips["trip_id"].astype(str))
+        self.service_calendar = service_calendar
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def day_key(self, day) -> bytes:
+        """
+        Computes the cache key of a day: its service pattern as packed bits.
+
+        Parameters:
+        - day (date, datetime or str): The service day.
+
+        Returns:
+        - (bytes): Identical for all days with the same set of active services.
+        """
+        column = self.service_calendar.day_column(day)
+        if column is None:
+            pattern = np.zeros(len(self.service_calendar.service_ids), dtype=bool)
+        else:
+            pattern = self.service_calendar.active[:, column]
+        return np.packbits(pattern).tobytes()
+
+    def get(self, day):
+        """
+        Returns the timetable of a service day, building it on a cache miss.
+
+        Parameters:
+        - day (date, datetime or str): The service day.
+
+        Returns:
+        - (Timetable): Timetable with all connections of the day.
+        """
+        key = self.day_key(day)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.misses += 1
+        active_trip_ids = self.service_calendar.active_trips(self.trips, day)
+        if self.stop_times is None:
+            stop_times = load_stop_times(self.gtfs_dir, active_trip_ids, verbose=False)
+            timetable = build_timetable_from_stop_times(stop_times, self.stops, self.trips)
+        else:
+            timetable = build_timetable_from_stop_times(self.stop_times, self.stops, self.trips, active_trip_ids)
+        self.entries[key] = timetable
+        self.nbytes += timetable.nbytes
+
+        # Evict least recently used entries, the entry just built is always kept
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+        return timetable
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the hit/miss statistics of the cache.
+
+        Returns:
+        - (dict): hits, misses, evictions, hit_rate, entries and nbytes.
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries), "nbytes": self.nbytes}
+
+
+# Cache of the feed seen last, the frames are kept so their ids stay unique
+_shared = None
+
+
+def shared_day_timetable_cache(stop_times, stops, trips, service_calendar,
+                               max_bytes: int = DEFAULT_MAX_BYTES, gtfs_dir: str = GTFS_DIR) -> DayTimetableCache:
+    """
+    Returns one DayTimetableCache per feed, created on the first call.
+
+    The tables are identified by object identity, so they must not be modified in place after the
+    first call (load new tables instead, which starts a new cache).
+
+    Parameters:
+    - stop_times, stops, trips (DataFrame): GTFS tables of the feed, stop_times None to stream them from gtfs_dir.
+    - service_calendar (ServiceCalendar): Calendar of the feed.
+    - max_bytes (int): Memory cap of a newly created cache.
+    - gtfs_dir (str): Feed the stop times are streamed from.
+
+    Returns:
+    - (DayTimetableCache): The shared cache of this feed.
+    """
+    global _shared
+    if _shared is None or _shared[4] != gtfs_dir \
+            or any(a is not b for a, b in zip(_shared[:4], (stop_times, stops, trips, service_calendar))):
+        _shared = (stop_times, stops, trips, service_calendar, gtfs_dir,
+                   DayTimetableCache(stop_times, stops, trips, service_calendar, max_bytes, gtfs_dir))
+    return _shared[5]
+
+
+if __name__ == "__main__":
+    from Code.import_data import import_data
+    from Code.service_calendar import ServiceCalendar
+
+    # Check: two days with the same service pattern share one entry (one miss, then one hit)
+    agency, stops, routes, trips, stop_times, calendar, calendar_dates = import_data()
+    service_calendar = ServiceCalendar(calendar, calendar_dates)
+    cache = DayTimetableCache(stop_times, stops, trips, service_calendar)
+    patterns = {}
+    for column in range(service_calendar.n_days):
+        day = date.fromordinal(service_calendar.first_day + column)
+        first_day = patterns.setdefault(cache.day_key(day), day)
+        if first_day != day:
+            assert cache.get(first_day) is cache.get(day)
+            assert (cache.misses, cache.hits) == (1, 1), cache.stats()
+            print(f"{first_day} and {day} share one timetable: {cache.stats()}")
+            break
+    else:
+        print("No two days of the feed have the same service pattern")
@@ -0,0 +1,319 @@
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.stats as stats
+
+from Code.gtfs_time import NO_TIME, parse_gtfs_times
+from Code.import_data import read_string_table, write_string_table
+
+'''
+Transfer probabilities from delay distributions fitted per route, stop and hour of the day.
+
+Offline, fit_delay_model reads historical stop events from CSV files (columns LOG_COLUMNS, times
+as GTFS 'HH:MM:SS' strings, one row per stop of a trip) and fits a Gamma distribution of the
+arrival delay and one of the departure delay in minutes for every (route, stop, hour of the
+scheduled time). Early events count as on time. The fit uses the method of moments, groups with
+fewer than MIN_OBSERVATIONS events fall back to (route, stop) over the whole day, then to the
+route, then to the whole log.
+
+A transfer at a stop from an arriving route to a departing route with a scheduled transfer time
+t succeeds if arrival delay - departure delay <= t. For every pair of routes that arrive and
+depart at the same stop, the probability is precomputed for every hour on a grid of transfer
+times (CURVE_STEP seconds up to MAX_CURVE_SECONDS) and stored as uint16. Equal parameter
+combinations share one curve, so the model directory holds the route and stop names, the keys
+with one curve id per hour and the distinct curves.
+
+At query time DelayModel only does a dict lookup and a linear interpolation in the curve:
+no fitting and no scipy call. Transfers without a curve use the curve of the whole log, or a
+fallback model (e.g. the global TransferProbabilityTable) if one is given. The routing engines
+(label_setting_search, raptor_search, mc_raptor_search) take a DelayModel as delay_model and look
+up the curve of every transfer by the route and stop indices of their Timetable.
+'''
+
+MODEL_NAME = "delay_model.npz"
+ROUTES_NAME = "routes.strings.npy"
+STOPS_NAME = "stops.strings.npy"
+
+LOG_COLUMNS = ["route_id", "stop_name", "scheduled_arrival", "actual_arrival", "scheduled_departure",
+               "actual_departure"]
+
+# Fewest events of a group fitted on its own
+MIN_OBSERVATIONS = 20
+# Lower limits of the mean (minutes) and variance of the delays (a log without delays still gets a Gamma distribution)
+MIN_MEAN_DELAY = 0.05
+MIN_DELAY_VARIANCE = 0.01
+
+# Grid of the transfer curves in seconds, longer transfers get the last value
+CURVE_STEP = 30
+MAX_CURVE_SECONDS = 3600
+# Quantiles of the departure delay used to integrate over it
+QUADRATURE_POINTS = 64
+PROBABILITY_SCALE = np.iinfo(np.uint16).max
+
+HOURS = 24
+ARRIVAL, DEPARTURE = 0, 1
+NO_CURVE = -1
+
+
+def read_delay_log(paths) -> pd.DataFrame:
+    """
+    Reads historical stop events and converts them into delays.
+
+    Parameters:
+    - paths (str or list): CSV file(s) with the columns LOG_COLUMNS, missing times are allowed.
+
+    Returns:
+    - (DataFrame): One row per observed arrival or departure with the columns route_id, stop_name,
+      kind (ARRIVAL or DEPARTURE), hour (of the scheduled time) and delay (minutes, at least 0).
+    """
+    paths = [paths] if isinstance(paths, str) else list(paths)
+    log = pd.concat([pd.read_csv(path, usecols=LOG_COLUMNS, dtype=str) for path in paths], ignore_index=True)
+    events = []
+    for kind, column in ((ARRIVAL, "arrival"), (DEPARTURE, "departure")):
+        scheduled = parse_gtfs_times(log["scheduled_" + column])
+        actual = parse_gtfs_times(log["actual_" + column])
+        observed = (scheduled != NO_TIME) & (actual != NO_TIME)
+        events.append(pd.DataFrame({
+            "route_id": log["route_id"].to_numpy()[observed],
+            "stop_name": log["stop_name"].to_numpy()[observed],
+            "kind": kind,
+            "hour": scheduled[observed] // 3600 % HOURS,
+            "delay": np.maximum(actual[observed] - scheduled[observed], 0) / 60,
+        }))
+    return pd.concat(events, ignore_index=True)
+
+
+def gamma_parameters(mean: float, variance: float) -> tuple:
+    # Method of moments: shape = mean² / variance, scale = variance / mean
+    mean = max(mean, MIN_MEAN_DELAY)
+    variance = max(variance, MIN_DELAY_VARIANCE)
+    return round(mean * mean / variance, 4), round(variance / mean, 4)
+
+
+def fit_delay_distributions(events: pd.DataFrame) -> tuple:
+    """
+    Fits the delay distributions of all groups.
+
+    Parameters:
+    - events (DataFrame): Delays as returned by read_delay_log.
+
+    Returns:
+    - tuple: (fits, overall) with fits as a list of dicts, one per level from (kind, route, stop, hour)
+      down to (kind, route), each mapping the group to its (shape, scale), and overall as
+      kind -> (shape, scale) of the whole log.
+    """
+    fits = []
+    for keys in (["kind", "route_id", "stop_name", "hour"], ["kind", "route_id", "stop_name"], ["kind", "route_id"]):
+        groups = events.groupby(keys)["delay"].agg(["count", "mean", "var"])
+        groups = groups[groups["count"] >= MIN_OBSERVATIONS]
+        fits.append({key: gamma_parameters(mean, variance) for key, mean, variance in
+                     zip(groups.index, groups["mean"], groups["var"])})
+    overall = {}
+    for kind in (ARRIVAL, DEPARTURE):
+        delays = events.loc[events["kind"] == kind, "delay"]
+        overall[kind] = gamma_parameters(delays.mean(), delays.var()) if len(delays) > 1 else gamma_parameters(0, 0)
+    return fits, overall
+
+
+def delay_parameters(fits: list, overall: dict, kind: int, route_id: str, stop_name: str, hour: int) -> tuple:
+    # Most specific fit with enough observations
+    keys = ((kind, route_id, stop_name, hour), (kind, route_id, stop_name), (kind, route_id))
+    for level, key in zip(fits, keys):
+        if key in level:
+            return level[key]
+    return overall[kind]
+
+
+def transfer_curve(arrival_parameters: tuple, departure_parameters: tuple) -> np.ndarray:
+    """
+    Probability of a transfer for every scheduled transfer time of the grid.
+
+    Parameters:
+    - arrival_parameters, departure_parameters (tuple): (shape, scale) of the arrival delay of the
+      arriving route and the departure delay of the departing route in minutes.
+
+    Returns:
+    - (np.ndarray): P(arrival delay - departure delay <= t) for t = 0, CURVE_STEP, ..., MAX_CURVE_SECONDS.
+    """
+    transfer_minutes = np.arange(0, MAX_CURVE_SECONDS + 1, CURVE_STEP) / 60
+    quantiles = (np.arange(QUADRATURE_POINTS) + 0.5) / QUADRATURE_POINTS
+    departure_delays = stats.gamma.ppf(quantiles, a=departure_parameters[0], scale=departure_parameters[1])
+    return stats.gamma.cdf(transfer_minutes[:, None] + departure_delays[None, :],
+                           a=arrival_parameters[0], scale=arrival_parameters[1]).mean(axis=1)
+
+
+def fit_delay_model(log_paths, model_dir: str) -> str:
+    """
+    Fits the delay distributions of a log and writes the transfer curves of all route pairs.
+
+    Parameters:
+    - log_paths (str or list): CSV file(s) of historical stop events (see read_delay_log).
+    - model_dir (str): Directory the model is written to.
+
+    Returns:
+    - (str): Path of the model file.
+    """
+    events = read_delay_log(log_paths)
+    fits, overall = fit_delay_distributions(events)
+
+    routes = sorted(events["route_id"].unique())
+    stops = sorted(events["stop_name"].unique())
+    route_index = {route: i for i, route in enumerate(routes)}
+    stop_index = {stop: i for i, stop in enumerate(stops)}
+
+    # Distinct curves by parameters, curve 0 is the one of the whole log
+    curve_of_parameters = {(overall[ARRIVAL], overall[DEPARTURE]): 0}
+    keys, curve_ids = [], []
+    served = events.groupby(["stop_name", "kind"])["route_id"].unique()
+    for stop in stops:
+        arriving = served.get((stop, ARRIVAL), [])
+        departing = served.get((stop, DEPARTURE), [])
+        for arriving_route in arriving:
+            for departing_route in departing:
+                if arriving_route == departing_route:
+                    continue
+                ids = []
+                for hour in range(HOURS):
+                    parameters = (delay_parameters(fits, overall, ARRIVAL, arriving_route, stop, hour),
+                                  delay_parameters(fits, overall, DEPARTURE, departing_route, stop, hour))
+                    ids.append(curve_of_parameters.setdefault(parameters, len(curve_of_parameters)))
+                keys.append((route_index[arriving_route], route_index[departing_route], stop_index[stop]))
+                curve_ids.append(ids)
+
+    curves = np.array([transfer_curve(*parameters) for parameters in curve_of_parameters])
+    keys = np.array(keys, dtype=np.int32).reshape(-1, 3)
+
+    os.makedirs(model_dir, exist_ok=True)
+    write_string_table(os.path.join(model_dir, ROUTES_NAME), [str(route) for route in routes])
+    write_string_table(os.path.join(model_dir, STOPS_NAME), [str(stop) for stop in stops])
+    path = os.path.join(model_dir, MODEL_NAME)
+    with open(path + ".tmp", "wb") as f:
+        np.savez_compressed(f, arriving_route=keys[:, 0], departing_route=keys[:, 1], stop=keys[:, 2],
+                            curve_ids=np.array(curve_ids, dtype=np.int32).reshape(-1, HOURS),
+                            curves=np.round(curves * PROBABILITY_SCALE).astype(np.uint16),
+                            curve_step=CURVE_STEP)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+class DelayModel:
+    """
+    Transfer curves loaded from a model directory written by fit_delay_model.
+
+    Attributes:
+    - curves (np.ndarray): Distinct transfer curves (float probabilities on the grid of curve_step seconds).
+    - curve_step (int): Grid step of the curves in seconds.
+    - curve_ids (dict): (arriving route, departing route, stop name) -> curve id for every hour.
+    - fallback (callable): Model of transfers without a curve, None uses the curve of the whole log.
+    """
+
+    def __init__(self, model_dir: str, fallback=None):
+        routes = read_string_table(os.path.join(model_dir, ROUTES_NAME))[:-1]
+        stops = read_string_table(os.path.join(model_dir, STOPS_NAME))[:-1]
+        with np.load(os.path.join(model_dir, MODEL_NAME)) as model:
+            self.curves = model["curves"] / PROBABILITY_SCALE
+            self.curve_step = int(model["curve_step"])
+            self.curve_ids = {(routes[a], routes[d], stops[s]): ids.tolist() for a, d, s, ids in
+                              zip(model["arriving_route"], model["departing_route"], model["stop"], model["curve_ids"])}
+        self.fallback = fallback
+        self._last = self.curves.shape[1] - 1
+        self._curve_lists = self.curves.tolist()
+
+    def curve_id(self, arriving_route, departing_route, stop_name, hour: int) -> int:
+        """
+        Curve of a transfer.
+
+        Parameters:
+        - arriving_route, departing_route: Route ids of the two legs.
+        - stop_name (str): Stop of the transfer.
+        - hour (int): Hour of the scheduled arrival (taken modulo 24).
+
+        Returns:
+        - (int): Curve id, NO_CURVE if the model has no curve for the transfer and a fallback is given.
+        """
+        # The log is read as strings, the route ids of a feed may be numbers
+        ids = self.curve_ids.get((str(arriving_route), str(departing_route), str(stop_name)))
+        if ids is None:
+            return NO_CURVE if self.fallback is not None else 0
+        return ids[hour % HOURS]
+
+    def transfer_probability(self, arriving_route, departing_route, stop_name, transfer_seconds,
+                             hour: int) -> float:
+        """
+        Probability of a single transfer.
+
+        Parameters:
+        - arriving_route, departing_route: Route ids of the two legs.
+        - stop_name (str): Stop of the transfer.
+        - transfer_seconds (int or float): Scheduled transfer time in seconds.
+        - hour (int): Hour of the scheduled arrival (taken modulo 24).
+
+        Returns:
+        - (float): Probability of catching the connection.
+        """
+        curve = self.curve_id(arriving_route, departing_route, stop_name, hour)
+        if curve == NO_CURVE:
+            return self.fallback(transfer_seconds)
+        values = self._curve_lists[curve]
+        position = max(transfer_seconds, 0) / self.curve_step
+        if position >= self._last:
+            return values[-1]
+        i = int(position)
+        return values[i] + (values[i + 1] - values[i]) * (position - i)
+
+    def timetable_transfer_probability(self, timetable, arriving_route: int, departing_route: int, stop: int,
+                                       transfer_seconds, arrival_time: int) -> float:
+        """
+        Probability of a transfer given by the indices of a Timetable, as used by the routing engines.
+
+        Parameters:
+        - timetable (Timetable): Timetable the indices refer to.
+        - arriving_route, departing_route (int): Route indices of the two legs.
+        - stop (int): Stop index of the transfer.
+        - transfer_seconds (int or float): Scheduled transfer time in seconds.
+        - arrival_time (int): Scheduled arrival at the transfer stop in seconds.
+
+        Returns:
+        - (float): Probability of catching the connection.
+        """
+        return self.transfer_probability(timetable.route_ids[arriving_route], timetable.route_ids[departing_route],
+                                         timetable.stop_names[stop], transfer_seconds, arrival_time // 3600)
+
+    def probabilities(self, transfer_seconds, curve_ids) -> np.ndarray:
+        """
+        Probabilities of many transfers at once.
+
+        Parameters:
+        - transfer_seconds (array-like): Scheduled transfer times in seconds.
+        - curve_ids (array-like): Curve of every transfer (see curve_id), same shape.
+
+        Returns:
+        - (np.ndarray): Probability of every transfer.
+        """
+        transfer_seconds = np.asarray(transfer_seconds, dtype=np.float64)
+        curve_ids = np.asarray(curve_ids)
+        position = np.clip(transfer_seconds / self.curve_step, 0, self._last)
+        i = np.minimum(position.astype(np.int64), self._last - 1)
+        rows = np.maximum(curve_ids, 0)
+        probability = self.curves[rows, i] + (self.curves[rows, i + 1] - self.curves[rows, i]) * (position - i)
+        if self.fallback is not None and np.any(curve_ids == NO_CURVE):
+            missing = curve_ids == NO_CURVE
+            probability[missing] = self.fallback.probabilities(transfer_seconds[missing])
+        return probability
+
+
+def load_delay_model(model_dir: str, fallback=None):
+    """
+    Loads a delay model if one has been fitted.
+
+    Parameters:
+    - model_dir (str): Directory written by fit_delay_model.
+    - fallback (callable, optional): Model of transfers without a curve (see DelayModel).
+
+    Returns:
+    - (DelayModel): The model, None if the directory holds no model.
+    """
+    if not os.path.exists(os.path.join(model_dir, MODEL_NAME)):
+        return None
+    return DelayModel(model_dir, fallback)
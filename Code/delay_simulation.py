@@ -0,0 +1,154 @@
+import numpy as np
+import scipy.stats as stats
+
+'''
+Monte Carlo simulation of delays on an itinerary and its backups.
+
+Every sample draws a departure delay for every leg from the delay distribution (in minutes, like
+transfer_probability_with_delays in djikstra_finished.py) and a deviation of the running time
+from RUNNING_TIME_DISTRIBUTION, for all samples at once as (samples x legs) arrays. The arrival
+delay of a leg is its departure delay plus the deviation, and a leg never arrives before it
+departed. On consecutive legs of the same trip the train cannot leave a stop before it arrived
+there, so delays carry along the trip. A leg is caught if it stays on the route of the previous
+leg or its delayed departure is at least min_transfer_seconds after the delayed arrival of the
+previous leg. At the first missed transfer the traveller switches to the backup starting at that node, if
+there is one; a missed transfer on a backup strands the traveller (the backups only cover the
+transfers of the primary itinerary).
+
+The random streams are derived from one seed with SeedSequence.spawn, one stream for the primary
+itinerary and one per backup, so the same seed gives the same samples, and the delays of the
+primary itinerary do not depend on the number of backups.
+'''
+
+# Positions in a leg tuple (trip_id, departure_node, departure_time, arrival_node, arrival_time, route_id, service_id)
+TRIP_ID, DEPARTURE_NODE, DEPARTURE_TIME, ARRIVAL_NODE, ARRIVAL_TIME, ROUTE_ID = 0, 1, 2, 3, 4, 5
+
+# Delay model of transfer_probability_with_delays (minutes)
+DELAY_DISTRIBUTION = stats.gamma(a=2, scale=1.5)
+
+# Deviation of the running time of a leg from the timetable (minutes, trains make up or lose time)
+RUNNING_TIME_DISTRIBUTION = stats.norm(loc=0, scale=1)
+
+# Itinerary taken by a sample besides the index of a backup
+PRIMARY = -1
+STRANDED = -2
+
+
+def draw_delays(legs: list, samples: int, delay_distribution, rng: np.random.Generator,
+                running_time_distribution=RUNNING_TIME_DISTRIBUTION) -> tuple:
+    """
+    Draws the departure delays and running time deviations of all legs for all samples.
+
+    Parameters:
+    - legs (list): Leg tuples.
+    - samples (int): Number of samples.
+    - delay_distribution: Frozen scipy.stats distribution of the departure delays in minutes.
+    - rng (np.random.Generator): Random stream.
+    - running_time_distribution: Frozen scipy.stats distribution of the running time deviations in minutes.
+
+    Returns:
+    - tuple: (departure_delays, running_time_deviations) as (samples x legs) arrays in seconds.
+    """
+    departure_delays = delay_distribution.rvs(size=(samples, len(legs)), random_state=rng) * 60
+    running_time_deviations = running_time_distribution.rvs(size=(samples, len(legs)), random_state=rng) * 60
+    return departure_delays, running_time_deviations
+
+
+def simulate_legs(legs: list, departure_delays: np.ndarray, running_time_deviations: np.ndarray,
+                  ready: np.ndarray = None, min_transfer_seconds: int = 0) -> tuple:
+    """
+    Follows the samples along a sequence of legs.
+
+    Parameters:
+    - legs (list): Leg tuples.
+    - departure_delays, running_time_deviations (np.ndarray): (samples x legs) delays and deviations in seconds.
+    - ready (np.ndarray, optional): Time of every sample at the first departure node after the transfer,
+      None if the first leg is always caught (start of the journey).
+    - min_transfer_seconds (int): Minimum time between the arrival and the departure of a transfer.
+
+    Returns:
+    - tuple: (first_missed, arrivals) with the index of the first missed leg of every sample
+      (len(legs) if all legs are caught) and the delayed arrivals as a (samples x legs) array.
+    """
+    departures = np.array([leg[DEPARTURE_TIME] for leg in legs], dtype=float) + departure_delays
+    arrivals = np.empty(departures.shape)
+    for k, leg in enumerate(legs):
+        if k > 0 and leg[TRIP_ID] == legs[k - 1][TRIP_ID]:
+            # The train leaves the stop at the earliest when it arrived there
+            np.maximum(departures[:, k], arrivals[:, k - 1], out=departures[:, k])
+        # Arrival delay = departure delay + running time deviation, never before the departure
+        arrivals[:, k] = np.maximum(departures[:, k] + (leg[ARRIVAL_TIME] - leg[DEPARTURE_TIME])
+                                    + running_time_deviations[:, k], departures[:, k])
+
+    routes = [leg[ROUTE_ID] for leg in legs]
+    same_route = np.array([routes[k] == routes[k - 1] for k in range(1, len(legs))], dtype=bool)
+
+    caught = np.ones(departures.shape, dtype=bool)
+    if ready is not None:
+        caught[:, 0] = departures[:, 0] >= ready
+    caught[:, 1:] = same_route | (departures[:, 1:] >= arrivals[:, :-1] + min_transfer_seconds)
+    missed = ~caught
+    first_missed = np.where(missed.any(axis=1), missed.argmax(axis=1), len(legs))
+    return first_missed, arrivals
+
+
+def simulate_itinerary(itinerary: list, backups: list, start_time: int, time_budget: int, samples: int = 100_000,
+                       delay_distribution=DELAY_DISTRIBUTION, min_transfer_seconds: int = 0, seed=None,
+                       running_time_distribution=RUNNING_TIME_DISTRIBUTION) -> tuple:
+    """
+    Simulates delays on a primary itinerary with backups.
+
+    Parameters:
+    - itinerary (list): Leg tuples of the primary itinerary.
+    - backups (list): Leg lists of the backup itineraries, a backup is taken if the transfer at the
+      departure node of its first leg is missed.
+    - start_time (int): Start of the journey in seconds since the start of the service day.
+    - time_budget (int): Time budget in seconds.
+    - samples (int): Number of samples.
+    - delay_distribution: Frozen scipy.stats distribution of the departure delays in minutes.
+    - min_transfer_seconds (int): Minimum time between the arrival and the departure of a transfer.
+    - seed (int, optional): Seed of the random streams.
+    - running_time_distribution: Frozen scipy.stats distribution of the running time deviations in minutes.
+
+    Returns:
+    - tuple: (arrival_times, taken, on_time_probability) with the arrival time of every sample
+      (inf if stranded), the itinerary it took (PRIMARY, index of the backup or STRANDED) and the
+      share of samples arriving within the time budget. Without legs every sample is stranded.
+    """
+    streams = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(1 + len(backups))]
+    arrival_times = np.full(samples, np.inf)
+    taken = np.full(samples, STRANDED, dtype=np.int64)
+    if not itinerary:
+        return arrival_times, taken, 0.0  # No itinerary was found
+
+    departure_delays, running_time_deviations = draw_delays(itinerary, samples, delay_distribution, streams[0],
+                                                            running_time_distribution)
+    first_missed, arrivals = simulate_legs(itinerary, departure_delays, running_time_deviations,
+                                           min_transfer_seconds=min_transfer_seconds)
+    on_primary = first_missed == len(itinerary)
+    arrival_times[on_primary] = arrivals[on_primary, -1]
+    taken[on_primary] = PRIMARY
+
+    # Backup by node of the transfer (first backup of a node, like the backup search keeps one per transfer)
+    backup_of_node = {}
+    for i, backup in enumerate(backups):
+        if backup:
+            backup_of_node.setdefault(backup[0][DEPARTURE_NODE], i)
+
+    for k in range(1, len(itinerary)):
+        node = itinerary[k - 1][ARRIVAL_NODE]
+        missed_here = np.flatnonzero(first_missed == k)
+        if node not in backup_of_node or len(missed_here) == 0:
+            continue
+        i = backup_of_node[node]
+        backup_departure_delays, backup_deviations = draw_delays(backups[i], samples, delay_distribution,
+                                                                 streams[1 + i], running_time_distribution)
+        backup_missed, backup_arrivals = simulate_legs(
+            backups[i], backup_departure_delays[missed_here], backup_deviations[missed_here],
+            ready=arrivals[missed_here, k - 1] + min_transfer_seconds, min_transfer_seconds=min_transfer_seconds)
+        on_backup = missed_here[backup_missed == len(backups[i])]
+        arrival_times[on_backup] = backup_arrivals[backup_missed == len(backups[i]), -1]
+        taken[on_backup] = i
+
+    on_time_probability = float(np.mean(arrival_times <= start_time + time_budget)) if samples else 0.0
+    return arrival_times, taken, on_time_probability
@@ -4,6 +4,7 @@ import heapq
 from collections import defaultdict
 from datetime import datetime
 from Code.import_data import import_data
+from Code.labels import LabelStore, NO_PARENT
 
 
 # Hilfsfunktion: Zeit in Minuten umwandeln
@@ -111,27 +112,28 @@ def create_graph_with_schedule(stop_times, stops, trips, calendar, calendar_date
 
 # Dijkstra-Algorithmus für den kürzesten Weg mit Startzeit
 def dijkstra_with_time(graph, start_name, end_name, start_time_minutes):
-    pq = [(start_time_minutes, start_name, [])]  # (Abfahrtszeit, aktueller Knoten, Pfad)
+    # Labels mit Elternverweis statt kopierter Pfadlisten in der Queue
+    labels = LabelStore()
+    pq = [(start_time_minutes, start_name, labels.add(NO_PARENT, start_name, start_time_minutes))]  # (Abfahrtszeit, aktueller Knoten, Label)
     visited = set()
 
     while pq:
-        current_time, current_stop, path = heapq.heappop(pq)
+        current_time, current_stop, label = heapq.heappop(pq)
 
         if (current_stop, current_time) in visited:
             continue
         visited.add((current_stop, current_time))
 
-        path = path + [(current_stop, current_time)]
-
         # 🔹 Hier zuerst die Nachbarn durchgehen
         for neighbor, departure_time, arrival_time, route_id in graph[current_stop]:
             # Berücksichtige nur Verbindungen nach der aktuellen Zeit
             if departure_time >= current_time:
-                heapq.heappush(pq, (arrival_time, neighbor, path + [(route_id, departure_time, arrival_time)]))
+                heapq.heappush(pq, (arrival_time, neighbor,
+                                    labels.add(label, neighbor, arrival_time, route_id, departure_time)))
 
         # 🔹 Jetzt erst prüfen, ob das Ziel erreicht wurde
         if current_stop == end_name:
-            return current_time, path
+            return current_time, labels.path(label)
 
     return float("inf"), []
 
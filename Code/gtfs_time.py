@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+'''
+GTFS times as integers.
+
+GTFS stores times as 'HH:MM:SS' strings relative to the start of the service day. Hours can be
+24 or larger for trips running past midnight, so the strings are converted to seconds since the
+start of the service day and never wrapped around. All engines compare these integers directly.
+'''
+
+# Marker for empty arrival/departure times (allowed in GTFS for stops that are not timepoints)
+NO_TIME = -1
+
+
+def time_to_seconds(time_str: str) -> int:
+    """
+    Converts a GTFS time string into seconds since the start of the service day.
+
+    Parameters:
+    - time_str (str): Time in 'HH:MM:SS' (or 'HH:MM') format, hours may be >= 24.
+
+    Returns:
+    - (int): Seconds since the start of the service day.
+    """
+    parts = [int(p) for p in time_str.strip().split(":")]
+    hours, minutes = parts[0], parts[1]
+    seconds = parts[2] if len(parts) > 2 else 0
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def seconds_to_time(seconds: int) -> str:
+    """
+    Converts seconds since the start of the service day back into 'HH:MM:SS'.
+
+    Parameters:
+    - seconds (int): Seconds since the start of the service day.
+
+    Returns:
+    - (str): Time in 'HH:MM:SS' format, hours are not wrapped at 24.
+    """
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def parse_gtfs_times(values) -> np.ndarray:
+    """
+    Vectorized conversion of a column of GTFS time strings into int32 seconds.
+
+    Every distinct string is parsed only once (a feed has at most a few ten thousand
+    distinct times), the result is spread back to all rows with one array lookup.
+
+    Parameters:
+    - values (array-like): Time strings, missing values become NO_TIME.
+
+    Returns:
+    - (ndarray): int32 seconds since the start of the service day.
+    """
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    parsed = np.array([time_to_seconds(u) for u in uniques] + [NO_TIME], dtype=np.int32)
+    # Code -1 (missing value) picks the NO_TIME entry at the end
+    return parsed[codes]
+
+
+def add_time_columns(stop_times: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds the integer columns 'arrival_seconds' and 'departure_seconds' to stop_times.
+
+    Parameters:
+    - stop_times (DataFrame): GTFS stop_times with 'arrival_time' and 'departure_time' strings.
+
+    Returns:
+    - (DataFrame): stop_times with the two additional int32 columns.
+    """
+    if "arrival_seconds" not in stop_times.columns:
+        stop_times = stop_times.assign(arrival_seconds=parse_gtfs_times(stop_times["arrival_time"]),
+                                       departure_seconds=parse_gtfs_times(stop_times["departure_time"]))
+    return stop_times
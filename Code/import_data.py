@@ -0,0 +1,306 @@
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+
+from Code.gtfs_time import add_time_columns, parse_gtfs_times
+
+'''
+GTFS import with a compiled binary cache.
+
+The first call of import_data() for a feed parses the GTFS text files once and writes a
+columnar cache next to them (one .npy per column, string columns as int32 codes plus a
+string table). The stop times are additionally stored as int32 seconds since the start of the
+service day ('arrival_seconds', 'departure_seconds'), so they are parsed only once. Every later
+call memory-maps the numeric arrays and hands them to the DataFrames without a copy (copy-on-write
+mappings, so the frames stay writable and a write never reaches the cache), pages are only read
+when a column is used. String columns are decoded into object arrays, which does allocate them.
+The cache is rebuilt automatically as soon as the size or modification time of one of the source
+files changes.
+'''
+
+# Directory of the GTFS feed, can be overwritten with the environment variable GTFS_DIR
+GTFS_DIR = os.environ.get("GTFS_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                   "gtfs_dummy_data"))
+
+CACHE_DIR_NAME = "_compiled"
+CACHE_VERSION = 2
+
+# Tables returned by import_data (shapes.txt is never used by the routing code and is skipped)
+GTFS_TABLES = ["agency", "stops", "routes", "trips", "stop_times", "calendar", "calendar_dates"]
+
+# Optional files are replaced by an empty table with these columns if they are missing in the feed
+OPTIONAL_TABLE_COLUMNS = {
+    "calendar": ["service_id", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
+                 "start_date", "end_date"],
+    "calendar_dates": ["service_id", "date", "exception_type"],
+}
+
+STRING_SEPARATOR = "\x00"
+
+# Columns of stop_times needed by the routing code and their compact dtypes for load_stop_times
+# (ids are always strings: an inferred dtype could differ from chunk to chunk, e.g. int64 for a
+# chunk that only holds numeric-looking trip ids)
+STOP_TIMES_COLUMNS = ["trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence"]
+STOP_TIMES_DTYPES = {"trip_id": str, "arrival_time": str, "departure_time": str, "stop_id": str,
+                     "stop_sequence": np.int32}
+STOP_TIMES_CHUNKSIZE = 1_000_000
+
+
+def source_signature(gtfs_dir: str) -> dict:
+    """
+    Collects size and modification time of all GTFS source files.
+
+    Parameters:
+    - gtfs_dir (str): Directory of the GTFS feed.
+
+    Returns:
+    - (dict): Mapping of file name to [size in bytes, mtime in nanoseconds], None for missing files.
+    """
+    signature = {}
+    for table in GTFS_TABLES:
+        path = os.path.join(gtfs_dir, table + ".txt")
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature[table + ".txt"] = [stat.st_size, stat.st_mtime_ns]
+        else:
+            signature[table + ".txt"] = None
+    return signature
+
+
+def cache_is_valid(gtfs_dir: str, cache_dir: str) -> bool:
+    """
+    Checks whether the compiled cache exists and was built from the current source files.
+
+    Parameters:
+    - gtfs_dir (str): Directory of the GTFS feed.
+    - cache_dir (str): Directory of the compiled cache.
+
+    Returns:
+    - (bool): True if the cache can be used.
+    """
+    manifest_path = os.path.join(cache_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    return manifest.get("version") == CACHE_VERSION and manifest.get("sources") == source_signature(gtfs_dir)
+
+
+def write_string_table(path: str, strings: list):
+    # All strings of a column are stored as one utf-8 buffer, separated by NUL bytes
+    buffer = STRING_SEPARATOR.join(strings).encode("utf-8")
+    np.save(path, np.frombuffer(buffer, dtype=np.uint8))
+
+
+def read_string_table(path: str) -> np.ndarray:
+    buffer = np.load(path, mmap_mode="r")
+    strings = bytes(buffer).decode("utf-8").split(STRING_SEPARATOR) if len(buffer) else [""]
+    # The last entry stands for missing values (code -1)
+    return np.array(strings + [np.nan], dtype=object)
+
+
+def compile_table(df: pd.DataFrame, table: str, cache_dir: str) -> dict:
+    """
+    Writes one table column by column into the cache directory.
+
+    Parameters:
+    - df (DataFrame): Parsed GTFS table.
+    - table (str): Name of the table (e.g. 'stop_times').
+    - cache_dir (str): Directory of the compiled cache.
+
+    Returns:
+    - (dict): Description of the table for the manifest (row count and column kinds).
+    """
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        base = os.path.join(cache_dir, f"{table}.{column}")
+        if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+            np.save(base + ".npy", values.to_numpy())
+            columns[column] = "numeric"
+        else:
+            # Strings are dictionary encoded: int32 codes plus a table with the unique values
+            codes, uniques = pd.factorize(values.astype(object))
+            np.save(base + ".codes.npy", codes.astype(np.int32))
+            write_string_table(base + ".strings.npy", [str(u) for u in uniques])
+            columns[column] = "string"
+    return {"rows": len(df), "columns": columns}
+
+
+def compile_feed(gtfs_dir: str = GTFS_DIR, cache_dir: str = None) -> str:
+    """
+    Parses all GTFS text files of a feed once and writes the compiled binary cache.
+
+    Parameters:
+    - gtfs_dir (str): Directory of the GTFS feed.
+    - cache_dir (str, optional): Target directory, default is '<gtfs_dir>/_compiled'.
+
+    Returns:
+    - (str): Directory of the compiled cache.
+    """
+    cache_dir = cache_dir or os.path.join(gtfs_dir, CACHE_DIR_NAME)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Remove the manifest first, so an interrupted compile never leaves a "valid" cache behind
+    manifest_path = os.path.join(cache_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    signature = source_signature(gtfs_dir)
+    tables = {}
+    for table in GTFS_TABLES:
+        df = read_gtfs_file(gtfs_dir, table)
+        tables[table] = compile_table(df, table, cache_dir)
+
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump({"version": CACHE_VERSION, "sources": signature, "tables": tables}, f, indent=1)
+    return cache_dir
+
+
+def read_gtfs_file(gtfs_dir: str, table: str) -> pd.DataFrame:
+    """
+    Reads a single GTFS text file, missing optional files become empty tables.
+    stop_times gets the integer time columns 'arrival_seconds' and 'departure_seconds'.
+
+    Parameters:
+    - gtfs_dir (str): Directory of the GTFS feed.
+    - table (str): Name of the table without '.txt'.
+
+    Returns:
+    - (DataFrame): The parsed table.
+    """
+    path = os.path.join(gtfs_dir, table + ".txt")
+    if not os.path.exists(path) and table in OPTIONAL_TABLE_COLUMNS:
+        return pd.DataFrame({column: pd.Series(dtype=np.int64) for column in OPTIONAL_TABLE_COLUMNS[table]})
+    df = pd.read_csv(path)
+    if table == "stop_times":
+        df = add_time_columns(df)
+    return df
+
+
+def load_table(table: str, manifest: dict, cache_dir: str) -> pd.DataFrame:
+    """
+    Loads one table from the compiled cache.
+
+    Parameters:
+    - table (str): Name of the table.
+    - manifest (dict): Parsed manifest of the cache.
+    - cache_dir (str): Directory of the compiled cache.
+
+    Returns:
+    - (DataFrame): The table with the same columns and dtypes as pd.read_csv would produce,
+      numeric columns backed by the memory-mapped cache files.
+    """
+    data = {}
+    for column, kind in manifest["tables"][table]["columns"].items():
+        base = os.path.join(cache_dir, f"{table}.{column}")
+        if kind == "numeric":
+            # Copy-on-write mapping: writes to the frame get private pages instead of failing or changing the file
+            data[column] = np.load(base + ".npy", mmap_mode="c")
+        else:
+            codes = np.load(base + ".codes.npy", mmap_mode="r")
+            data[column] = read_string_table(base + ".strings.npy")[codes]
+    # copy=False keeps every numeric column as its own block on the mapping instead of consolidating copies
+    return pd.DataFrame(data, copy=False)
+
+
+def import_data(gtfs_dir: str = GTFS_DIR, use_cache: bool = True, tables: list = GTFS_TABLES):
+    """
+    Loads the GTFS feed, using (and if necessary building) the compiled binary cache.
+
+    Parameters:
+    - gtfs_dir (str): Directory of the GTFS feed.
+    - use_cache (bool): If False, the text files are parsed directly without touching the cache.
+    - tables (list): Tables to load, in this order (default: all of GTFS_TABLES). Leave out
+      'stop_times' if they are streamed with load_stop_times.
+
+    Returns:
+    - tuple: (agency, stops, routes, trips, stop_times, calendar, calendar_dates) DataFrames,
+      or the requested tables.
+    """
+    if not use_cache:
+        return tuple(read_gtfs_file(gtfs_dir, table) for table in tables)
+
+    cache_dir = os.path.join(gtfs_dir, CACHE_DIR_NAME)
+    if not cache_is_valid(gtfs_dir, cache_dir):
+        print(f"Compiling GTFS feed {gtfs_dir} ...")
+        compile_feed(gtfs_dir, cache_dir)
+
+    with open(os.path.join(cache_dir, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    return tuple(load_table(table, manifest, cache_dir) for table in tables)
+
+
+def load_stop_times(gtfs_dir: str = GTFS_DIR, active_trip_ids=None, start_seconds: int = None,
+                    end_seconds: int = None, chunksize: int = STOP_TIMES_CHUNKSIZE, verbose: bool = True):
+    """
+    Streams stop_times.txt in chunks and keeps only the rows needed for one query.
+
+    Only the columns in STOP_TIMES_COLUMNS are read. The time strings are replaced by the int32
+    columns 'arrival_seconds' and 'departure_seconds' chunk by chunk, and the service and time
+    window filters are applied before a chunk is kept, so the full table is never in memory.
+
+    Parameters:
+    - gtfs_dir (str): Directory of the GTFS feed.
+    - active_trip_ids (array-like, optional): Only these trips are kept (e.g. ServiceCalendar.active_trips),
+      compared as strings.
+    - start_seconds, end_seconds (int, optional): Time window in seconds since the start of the service day.
+    - chunksize (int): Number of rows read per chunk.
+    - verbose (bool): Print rows kept, memory held by the kept rows and the current chunk, and the
+      measured peak memory of the process per chunk.
+
+    Returns:
+    - (DataFrame): trip_id, stop_id (both as strings), stop_sequence, arrival_seconds, departure_seconds
+      of the kept rows.
+    """
+    if active_trip_ids is not None:
+        active_trip_ids = pd.Index(pd.unique(np.asarray(active_trip_ids).astype(str)))
+
+    kept, kept_bytes = [], 0
+    reader = pd.read_csv(os.path.join(gtfs_dir, "stop_times.txt"), usecols=STOP_TIMES_COLUMNS,
+                         dtype=STOP_TIMES_DTYPES, chunksize=chunksize)
+    for i, chunk in enumerate(reader):
+        chunk_bytes = int(chunk.memory_usage(deep=True).sum())
+        arrival = parse_gtfs_times(chunk.pop("arrival_time"))
+        departure = parse_gtfs_times(chunk.pop("departure_time"))
+
+        mask = np.ones(len(chunk), dtype=bool)
+        if active_trip_ids is not None:
+            mask &= active_trip_ids.get_indexer(chunk["trip_id"]) >= 0
+        if start_seconds is not None:
+            mask &= arrival >= start_seconds
+        if end_seconds is not None:
+            mask &= departure <= end_seconds
+
+        part = chunk[mask].assign(arrival_seconds=arrival[mask], departure_seconds=departure[mask])
+        kept.append(part)
+        kept_bytes += int(part.memory_usage(deep=True).sum())
+        if verbose:
+            peak_rss = process_peak_memory()
+            print(f"stop_times chunk {i}: kept {len(part)} of {len(chunk)} rows, "
+                  f"held {(kept_bytes + chunk_bytes) / 1024 ** 2:.1f} MB (kept rows + chunk), "
+                  f"process peak {'n/a' if peak_rss is None else f'{peak_rss / 1024 ** 2:.1f} MB'}")
+
+    if not kept:
+        return pd.DataFrame({"trip_id": pd.Series(dtype=str), "stop_id": pd.Series(dtype=str),
+                             **{column: pd.Series(dtype=np.int32) for column in
+                                ["stop_sequence", "arrival_seconds", "departure_seconds"]}})
+    return pd.concat(kept, ignore_index=True)
+
+
+def process_peak_memory():
+    """
+    Measured peak resident memory of the process so far.
+
+    Returns:
+    - (int): Bytes, None where the resource module is not available (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak if sys.platform == "darwin" else peak * 1024
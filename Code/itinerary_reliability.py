@@ -0,0 +1,125 @@
+import numpy as np
+
+'''
+Reliability of many itineraries in one NumPy pass.
+
+The itineraries are lists of legs (trip_id, departure_node, departure_time, arrival_node,
+arrival_time, route_id, service_id) with times in seconds since the start of the service day.
+pad_itineraries turns them into rectangular arrays (one row per itinerary, one column per leg,
+shorter itineraries padded), so the transfer probabilities of all leg pairs are looked up in a
+TransferProbabilityTable (or in the curves of a DelayModel) at once. A change between two legs of
+the same route is certain, padding columns count as certain as well.
+
+The products are accumulated leg by leg (np.cumprod), in the same order as math.prod over the
+legs of a single itinerary, so the batch gives exactly the values of the per-itinerary functions.
+'''
+
+# Positions in a leg tuple
+DEPARTURE_TIME, ARRIVAL_NODE, ARRIVAL_TIME, ROUTE_ID = 2, 3, 4, 5
+
+
+def pad_itineraries(itineraries: list) -> tuple:
+    """
+    Converts itineraries into padded arrays.
+
+    Parameters:
+    - itineraries (list): Itineraries as lists of leg tuples.
+
+    Returns:
+    - tuple: (departures, arrivals, routes, lengths) with departures, arrivals and routes as
+      (itineraries x legs) int64 arrays (routes as codes, equal codes for equal route ids) and
+      lengths as the number of legs of every itinerary.
+    """
+    n = len(itineraries)
+    lengths = np.fromiter((len(itinerary) for itinerary in itineraries), dtype=np.int64, count=n)
+    width = max(int(lengths.max()), 1) if n else 1
+    departures = np.zeros((n, width), dtype=np.int64)
+    arrivals = np.zeros((n, width), dtype=np.int64)
+    routes = np.full((n, width), -1, dtype=np.int64)
+    route_codes = {}
+    for i, itinerary in enumerate(itineraries):
+        k = len(itinerary)
+        departures[i, :k] = [leg[DEPARTURE_TIME] for leg in itinerary]
+        arrivals[i, :k] = [leg[ARRIVAL_TIME] for leg in itinerary]
+        routes[i, :k] = [route_codes.setdefault(leg[ROUTE_ID], len(route_codes)) for leg in itinerary]
+    return departures, arrivals, routes, lengths
+
+
+def transfer_curves(itineraries: list, width: int, delay_model) -> np.ndarray:
+    """
+    Curve of a DelayModel for every transfer of padded itineraries.
+
+    Parameters:
+    - itineraries (list): Itineraries as lists of leg tuples.
+    - width (int): Number of leg columns of the padded arrays.
+    - delay_model (DelayModel): Model with curves per (arriving route, departing route, stop).
+
+    Returns:
+    - (np.ndarray): (itineraries x legs) curve ids, column k for the change onto leg k (column 0 unused).
+    """
+    curves = np.zeros((len(itineraries), width), dtype=np.int64)
+    for i, itinerary in enumerate(itineraries):
+        for k in range(1, len(itinerary)):
+            prev_leg, next_leg = itinerary[k - 1], itinerary[k]
+            curves[i, k] = delay_model.curve_id(prev_leg[ROUTE_ID], next_leg[ROUTE_ID], prev_leg[ARRIVAL_NODE],
+                                                prev_leg[ARRIVAL_TIME] // 3600)
+    return curves
+
+
+def transfer_probabilities(departures: np.ndarray, arrivals: np.ndarray, routes: np.ndarray, lengths: np.ndarray,
+                           transfer_probability, min_transfer_seconds: int = None, curves: np.ndarray = None) -> np.ndarray:
+    """
+    Probability of catching every leg of every itinerary.
+
+    Parameters:
+    - departures, arrivals, routes, lengths (np.ndarray): Padded itineraries (see pad_itineraries).
+    - transfer_probability (TransferProbabilityTable or DelayModel): Transfer model.
+    - min_transfer_seconds (int, optional): Transfers shorter than this fail (probability 0).
+    - curves (np.ndarray, optional): Curves of a DelayModel for every transfer (see transfer_curves).
+
+    Returns:
+    - (np.ndarray): (itineraries x legs) probabilities, 1 for the first leg, legs on the same route
+      as the previous one and padding.
+    """
+    probabilities = np.ones(departures.shape)
+    width = departures.shape[1]
+    if width > 1:
+        transfer_times = departures[:, 1:] - arrivals[:, :-1]
+        transfer = (routes[:, 1:] != routes[:, :-1]) & (np.arange(1, width) < lengths[:, None])
+        if curves is None:
+            probability = transfer_probability.probabilities(transfer_times)
+        else:
+            probability = transfer_probability.probabilities(transfer_times, curves[:, 1:])
+        if min_transfer_seconds is not None:
+            probability[transfer_times < min_transfer_seconds] = 0
+        probabilities[:, 1:] = np.where(transfer, probability, 1)
+    return probabilities
+
+
+def batch_reliability(departures: np.ndarray, arrivals: np.ndarray, routes: np.ndarray, lengths: np.ndarray,
+                      transfer_probability, start_time: int = None, time_budget: int = None,
+                      min_transfer_seconds: int = None, curves: np.ndarray = None) -> np.ndarray:
+    """
+    Product of the transfer probabilities of every itinerary.
+
+    Parameters:
+    - departures, arrivals, routes, lengths (np.ndarray): Padded itineraries (see pad_itineraries).
+    - transfer_probability (TransferProbabilityTable or DelayModel): Transfer model.
+    - start_time (int, optional): Start of the journey in seconds.
+    - time_budget (int, optional): Itineraries arriving later than start_time + time_budget get 0.
+    - min_transfer_seconds (int, optional): Transfers shorter than this fail (probability 0).
+    - curves (np.ndarray, optional): Curves of a DelayModel for every transfer (see transfer_curves).
+
+    Returns:
+    - (np.ndarray): Reliability of every itinerary.
+    """
+    if len(lengths) == 0:
+        return np.zeros(0)
+    probabilities = transfer_probabilities(departures, arrivals, routes, lengths, transfer_probability,
+                                           min_transfer_seconds, curves)
+    last = lengths - 1
+    rows = np.arange(len(lengths))
+    reliability = np.cumprod(probabilities, axis=1)[rows, last]
+    if time_budget is not None:
+        reliability[arrivals[rows, last] - start_time > time_budget] = 0
+    return reliability
@@ -0,0 +1,97 @@
+import heapq
+
+from Code.labels import LabelStore, NO_PARENT
+
+'''
+Label-setting time-dependent search on a Timetable.
+
+Every stop keeps one bag of labels per incoming route (the route decides whether the next
+connection is a transfer). A bag only holds Pareto-optimal labels with respect to
+(arrival time, reliability): a new label is dropped if a label of the bag arrives no later with
+at least the same reliability, and labels it dominates are removed from the bag. The queue is
+ordered by arrival time and, for equal times, by descending reliability, so the first label
+popped at the target is the earliest arrival with the best reliability and the search stops there.
+'''
+
+# Minimum transfer time between two different routes in seconds (same rule as in Aktuell.py)
+MIN_TRANSFER_TIME = 5 * 60
+NO_ROUTE = -1
+
+
+def dominates(time_a, reliability_a, time_b, reliability_b) -> bool:
+    # Label a is at least as good as label b in both criteria
+    return time_a <= time_b and reliability_a >= reliability_b
+
+
+def label_setting_search(graph, start_stop: int, end_stop: int, start_time: int, time_budget: int,
+                         excluded=frozenset(), transfer_probability=None,
+                         min_transfer_time: int = MIN_TRANSFER_TIME, delay_model=None) -> tuple:
+    """
+    Earliest arrival search with transfer reliabilities on a Timetable.
+
+    Parameters:
+    - graph (Timetable): Timetable of the service day.
+    - start_stop, end_stop (int): Stop indices of origin and destination.
+    - start_time (int): Departure time at the origin in seconds.
+    - time_budget (int): Maximum travel time in seconds.
+    - excluded (set, optional): Route indices that must not be used.
+    - transfer_probability (callable, optional): Maps the transfer time in seconds to the
+      probability of catching the connection, transfers are certain if not given.
+    - min_transfer_time (int): Minimum time in seconds for a change between two routes.
+    - delay_model (DelayModel, optional): Transfer curves per arriving route, departing route, stop and
+      hour, used instead of transfer_probability.
+
+    Returns:
+    - tuple: (arrival time, path, reliability) with the path as alternating (stop, time) and
+      (route, departure, arrival) tuples of indices and seconds, or (inf, [], 0.0) if the
+      destination cannot be reached within the budget.
+    """
+    labels = LabelStore()
+    root = labels.add(NO_PARENT, start_stop, start_time, NO_ROUTE, None, 1.0)
+    bags = {(start_stop, NO_ROUTE): [root]}
+    removed = set()
+    pq = [(start_time, -1.0, root)]  # (arrival time, -reliability, label)
+    latest_arrival = start_time + time_budget
+
+    while pq:
+        current_time, _, label = heapq.heappop(pq)
+        if label in removed:
+            continue  # dominated by a label found later
+
+        current_stop = labels.stop[label]
+        if current_stop == end_stop:
+            return current_time, labels.path(label), labels.reliability[label]
+
+        reliability = labels.reliability[label]
+        last_route = labels.route[label]
+
+        for neighbor, departure_time, arrival_time, route_id in zip(*graph.departures_after(current_stop, current_time)):
+            if route_id in excluded or arrival_time > latest_arrival:
+                continue
+
+            new_reliability = reliability
+            if last_route != NO_ROUTE and last_route != route_id:
+                transfer_time = departure_time - current_time
+                if transfer_time < min_transfer_time:
+                    continue
+                if delay_model is not None:
+                    new_reliability = reliability * delay_model.timetable_transfer_probability(
+                        graph, last_route, route_id, current_stop, transfer_time, current_time)
+                elif transfer_probability is not None:
+                    new_reliability = reliability * transfer_probability(transfer_time)
+
+            # Keep the label only if no label of the bag (stop, incoming route) dominates it
+            bag = bags.setdefault((neighbor, route_id), [])
+            if any(dominates(labels.time[other], labels.reliability[other], arrival_time, new_reliability)
+                   for other in bag):
+                continue
+            for other in bag:
+                if dominates(arrival_time, new_reliability, labels.time[other], labels.reliability[other]):
+                    removed.add(other)
+            bag[:] = [other for other in bag if other not in removed]
+
+            new_label = labels.add(label, neighbor, arrival_time, route_id, departure_time, new_reliability)
+            bag.append(new_label)
+            heapq.heappush(pq, (arrival_time, -new_reliability, new_label))
+
+    return float("inf"), [], 0.0
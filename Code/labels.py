@@ -0,0 +1,80 @@
+'''
+Label store for the label-setting searches.
+
+Instead of pushing a copy of the whole path into the priority queue for every relaxation, every
+label is appended once to an arena of parallel lists and only remembers the index of its parent
+label. The queue entries stay constant in size and the path is reconstructed once, for the
+result only.
+'''
+
+NO_PARENT = -1
+
+
+class LabelStore:
+    """
+    Arena of search labels, a label is an index into the parallel lists.
+
+    Attributes:
+    - parent (list): Index of the previous label, NO_PARENT for the start label.
+    - stop (list): Stop reached by the label.
+    - time (list): Arrival time at the stop.
+    - route (list): Route used to reach the stop (None for the start label).
+    - departure (list): Departure time of that route at the parent stop.
+    - reliability (list): Reliability of the path up to this label.
+    """
+
+    def __init__(self):
+        self.parent = []
+        self.stop = []
+        self.time = []
+        self.route = []
+        self.departure = []
+        self.reliability = []
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def add(self, parent: int, stop, time, route=None, departure=None, reliability: float = 1.0) -> int:
+        """
+        Appends a new label.
+
+        Parameters:
+        - parent (int): Index of the previous label (NO_PARENT for the start).
+        - stop: Reached stop.
+        - time: Arrival time at the stop.
+        - route: Route of the connection leading to the stop.
+        - departure: Departure time of that connection.
+        - reliability (float): Reliability of the path up to this label.
+
+        Returns:
+        - (int): Index of the new label.
+        """
+        self.parent.append(parent)
+        self.stop.append(stop)
+        self.time.append(time)
+        self.route.append(route)
+        self.departure.append(departure)
+        self.reliability.append(reliability)
+        return len(self.parent) - 1
+
+    def path(self, label: int) -> list:
+        """
+        Reconstructs the path ending in a label.
+
+        Parameters:
+        - label (int): Index of the last label.
+
+        Returns:
+        - (list): Alternating (stop, time) and (route, departure, arrival) tuples from the start.
+        """
+        chain = []
+        while label != NO_PARENT:
+            chain.append(label)
+            label = self.parent[label]
+        chain.reverse()
+
+        path = [(self.stop[chain[0]], self.time[chain[0]])]
+        for label in chain[1:]:
+            path.append((self.route[label], self.departure[label], self.time[label]))
+            path.append((self.stop[label], self.time[label]))
+        return path
@@ -0,0 +1,255 @@
+from Code.label_search import MIN_TRANSFER_TIME, NO_ROUTE
+from Code.raptor import MAX_ROUNDS, raptor_timetable
+
+'''
+Multi-criteria RAPTOR (McRAPTOR) with the criteria arrival time, reliability and number of trips.
+
+Instead of one arrival time per stop, every stop keeps a bag of Pareto-optimal labels
+(arrival time, reliability); the number of trips is the round in which a label was created.
+A pattern is traversed with a route bag of (trip, reliability) labels. When boarding, the earliest
+reachable trip and every later trip with a strictly higher transfer probability (more slack for
+the transfer) are considered, because waiting longer can be more reliable. One run returns the
+complete Pareto front at the destination, the most reliable journey within the budget is read off it.
+'''
+
+NO_LABEL = -1
+
+
+def dominates(time_a, reliability_a, time_b, reliability_b) -> bool:
+    return time_a <= time_b and reliability_a >= reliability_b
+
+
+def insert_label(bag: list, labels: list, label: int, round_index: int, round_of: dict) -> bool:
+    # Adds the label to a stop bag unless a label with no more trips dominates it, labels with at least as many
+    # trips that it dominates are removed. Within one run the bag only holds labels of earlier or the same round,
+    # the profile keeps the bags of later departures, whose labels can have more trips.
+    time, reliability = labels[label][0], labels[label][1]
+    for other in bag:
+        if round_of[other] <= round_index and dominates(labels[other][0], labels[other][1], time, reliability):
+            return False
+    bag[:] = [other for other in bag if round_of[other] < round_index or
+              not dominates(time, reliability, labels[other][0], labels[other][1])]
+    bag.append(label)
+    return True
+
+
+def mc_raptor_search(timetable, start_stop: int, end_stop: int, start_time: int, time_budget: int,
+                     excluded=frozenset(), transfer_probability=None, max_rounds: int = MAX_ROUNDS,
+                     min_transfer_time: int = MIN_TRANSFER_TIME, delay_model=None) -> list:
+    """
+    Computes the Pareto front over (arrival time, reliability, number of trips) in one run.
+
+    Parameters:
+    - timetable (Timetable): Timetable of the service day.
+    - start_stop, end_stop (int): Stop indices of origin and destination.
+    - start_time (int): Departure time at the origin in seconds.
+    - time_budget (int): Maximum travel time in seconds.
+    - excluded (set, optional): Route indices that must not be used.
+    - transfer_probability (callable, optional): Maps the transfer time in seconds to a probability.
+    - max_rounds (int): Maximum number of trips of a journey.
+    - min_transfer_time (int): Minimum time in seconds for a change between two routes.
+    - delay_model (DelayModel, optional): Transfer curves per arriving route, departing route, stop and
+      hour, used instead of transfer_probability.
+
+    Returns:
+    - (list): (arrival time, reliability, trips, path, hop_trips) per Pareto-optimal journey, sorted by
+      arrival time. The path has the usual alternating format, hop_trips holds the trip index of every
+      connection of the path.
+    """
+    data = raptor_timetable(timetable)
+    # Label arena: (time, reliability, route, parent label, pattern, trip, boarding position, alighting position)
+    labels = [(start_time, 1.0, NO_ROUTE, NO_LABEL, -1, -1, -1, -1)]
+    round_of = {0: 0}
+    bags = {start_stop: [0]}
+    run_rounds(data, labels, round_of, bags, 0, start_stop, end_stop, start_time + time_budget, excluded,
+               transfer_probability, max_rounds, min_transfer_time, delay_model, timetable)
+
+    journeys = []
+    for label in bags.get(end_stop, []):
+        if label == 0:
+            continue
+        path, hop_trips = mc_raptor_path(data, labels, label, start_stop, start_time)
+        journeys.append((labels[label][0], labels[label][1], round_of[label], path, hop_trips))
+    journeys.sort(key=lambda journey: (journey[0], -journey[1]))
+    return journeys
+
+
+def mc_raptor_profile(timetable, start_stop: int, end_stop: int, earliest_departure: int, latest_departure: int,
+                      time_budget: int, excluded=frozenset(), transfer_probability=None,
+                      max_rounds: int = MAX_ROUNDS, min_transfer_time: int = MIN_TRANSFER_TIME,
+                      delay_model=None) -> list:
+    """
+    Profile query: the Pareto front for every departure at the origin within a departure window.
+
+    The departures are processed from the latest to the earliest (as in rRAPTOR) and the stop bags
+    are kept between the runs. A journey of a later departure can also be taken when leaving earlier,
+    so its labels prune the next run and every run only explores what the earlier departure improves.
+    A label only prunes labels with at least as many trips, so a journey with fewer trips from an
+    earlier departure is kept even if a later departure arrives earlier with more transfers.
+
+    Parameters:
+    - timetable (Timetable): Timetable of the service day, covering the window and the budget.
+    - start_stop, end_stop (int): Stop indices of origin and destination.
+    - earliest_departure, latest_departure (int): Departure window at the origin in seconds.
+    - time_budget (int): Maximum travel time in seconds, counted from each departure.
+    - excluded (set, optional): Route indices that must not be used.
+    - transfer_probability (callable, optional): Maps the transfer time in seconds to a probability.
+    - max_rounds (int): Maximum number of trips of a journey.
+    - min_transfer_time (int): Minimum time in seconds for a change between two routes.
+    - delay_model (DelayModel, optional): Transfer curves per arriving route, departing route, stop and
+      hour, used instead of transfer_probability.
+
+    Returns:
+    - (list): (departure time, journeys) per departure with journeys not dominated by a later departure
+      in (arrival time, reliability, trips), sorted by departure. The journeys have the format of mc_raptor_search.
+    """
+    if start_stop == end_stop:
+        return []
+    data = raptor_timetable(timetable)
+
+    # Every departure of a usable pattern at the origin within the window starts one run
+    departures = set()
+    for pattern_index, position in data.stop_patterns[start_stop]:
+        pattern = data.patterns[pattern_index]
+        if pattern.route in excluded:
+            continue
+        column = pattern.departure_columns[position]
+        for trip in range(pattern.earliest_trip(position, earliest_departure), len(column)):
+            if column[trip] > latest_departure:
+                break
+            departures.add(column[trip])
+
+    labels, round_of, bags = [], {}, {}
+    profile = []
+    for departure in sorted(departures, reverse=True):
+        start_label = len(labels)
+        labels.append((departure, 1.0, NO_ROUTE, NO_LABEL, -1, -1, -1, -1))
+        round_of[start_label] = 0
+        insert_label(bags.setdefault(start_stop, []), labels, start_label, 0, round_of)
+        run_rounds(data, labels, round_of, bags, start_label, start_stop, end_stop, departure + time_budget,
+                   excluded, transfer_probability, max_rounds, min_transfer_time, delay_model, timetable)
+
+        # Only the journeys of this run are new, the others leave later
+        journeys = []
+        for label in bags.get(end_stop, []):
+            if label > start_label:
+                path, hop_trips = mc_raptor_path(data, labels, label, start_stop, departure)
+                journeys.append((labels[label][0], labels[label][1], round_of[label], path, hop_trips))
+        if journeys:
+            journeys.sort(key=lambda journey: (journey[0], -journey[1]))
+            profile.append((departure, journeys))
+    profile.reverse()
+    return profile
+
+
+def run_rounds(data, labels: list, round_of: dict, bags: dict, start_label: int, start_stop: int, end_stop: int,
+               latest_arrival: int, excluded, transfer_probability, max_rounds: int, min_transfer_time: int,
+               delay_model=None, timetable=None):
+    # McRAPTOR rounds from one start label, the labels and bags are extended in place
+    new_labels = {start_stop: [start_label]}
+
+    for k in range(1, max_rounds + 1):
+        queue = {}
+        for stop in new_labels:
+            for pattern_index, position in data.stop_patterns[stop]:
+                if position < queue.get(pattern_index, len(data.patterns[pattern_index].stops)):
+                    queue[pattern_index] = position
+
+        previous, new_labels = new_labels, {}
+        for pattern_index, first_position in queue.items():
+            pattern = data.patterns[pattern_index]
+            if pattern.route in excluded:
+                continue
+            route_bag = []  # (trip, reliability, parent label, boarding position)
+            for position in range(first_position, len(pattern.stops)):
+                stop = pattern.stops[position]
+
+                # Alight every route label at this stop
+                for trip, reliability, parent, boarding_position in route_bag:
+                    arrival = pattern.arrivals[trip][position]
+                    if arrival > latest_arrival:
+                        continue
+                    target_bag = bags.get(end_stop, [])
+                    if any(round_of[other] <= k and dominates(labels[other][0], labels[other][1], arrival, reliability)
+                           for other in target_bag):
+                        continue  # target pruning
+                    label = len(labels)
+                    labels.append((arrival, reliability, pattern.route, parent, pattern_index, trip,
+                                   boarding_position, position))
+                    round_of[label] = k
+                    if insert_label(bags.setdefault(stop, []), labels, label, k, round_of):
+                        new_labels.setdefault(stop, []).append(label)
+
+                # Board with the labels of the previous round at this stop
+                if position == len(pattern.stops) - 1 or stop not in previous:
+                    continue
+                for parent in previous[stop]:
+                    if parent not in bags[stop]:
+                        continue  # removed by a dominating label of the same round
+                    time, reliability, last_route = labels[parent][0], labels[parent][1], labels[parent][2]
+                    is_transfer = last_route != NO_ROUTE and last_route != pattern.route
+                    ready = time + min_transfer_time if is_transfer else time
+                    best_probability = -1.0
+                    for trip in range(pattern.earliest_trip(position, ready), len(pattern.trips)):
+                        departure = pattern.departures[trip][position]
+                        if departure > latest_arrival:
+                            break
+                        probability = 1.0
+                        if is_transfer and delay_model is not None:
+                            probability = delay_model.timetable_transfer_probability(
+                                timetable, last_route, pattern.route, stop, departure - time, time)
+                        elif is_transfer and transfer_probability is not None:
+                            probability = transfer_probability(departure - time)
+                        if probability <= best_probability and probability > 0:
+                            break  # the transfer probability no longer increases, later trips are dominated
+                        best_probability = probability
+                        if reliability * probability <= 0:
+                            continue
+                        candidate = (trip, reliability * probability, parent, position)
+                        if not any(other[0] <= trip and other[1] >= candidate[1] for other in route_bag):
+                            route_bag = [other for other in route_bag
+                                         if not (trip <= other[0] and candidate[1] >= other[1])]
+                            route_bag.append(candidate)
+                        if probability >= 1.0:
+                            break
+
+        # Drop labels of this round that were dominated later in the same round
+        new_labels = {stop: [label for label in stop_labels if label in bags[stop]]
+                      for stop, stop_labels in new_labels.items()}
+        new_labels = {stop: stop_labels for stop, stop_labels in new_labels.items() if stop_labels}
+        if not new_labels:
+            break
+
+
+def mc_raptor_path(data, labels: list, label: int, start_stop: int, start_time: int) -> tuple:
+    # Follows the parent labels back to the origin and expands every ride into its connections
+    rides = []
+    while labels[label][3] != NO_LABEL:
+        _, _, _, parent, pattern_index, trip, boarding_position, alighting_position = labels[label]
+        rides.append((data.patterns[pattern_index], trip, boarding_position, alighting_position))
+        label = parent
+    rides.reverse()
+
+    path, hop_trips = [(start_stop, start_time)], []
+    for pattern, trip, boarding_position, alighting_position in rides:
+        for position in range(boarding_position, alighting_position):
+            arrival = pattern.arrivals[trip][position + 1]
+            path.append((pattern.route, pattern.departures[trip][position], arrival))
+            path.append((pattern.stops[position + 1], arrival))
+            hop_trips.append(pattern.trips[trip])
+    return path, hop_trips
+
+
+def most_reliable_journey(journeys: list):
+    """
+    Reads the most reliable journey off a Pareto front (earlier arrival on ties).
+
+    Parameters:
+    - journeys (list): Result of mc_raptor_search.
+
+    Returns:
+    - (tuple): The journey, None if the front is empty.
+    """
+    if not journeys:
+        return None
+    return max(journeys, key=lambda journey: (journey[1], -journey[0]))
@@ -0,0 +1,129 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from Code.gtfs_time import NO_TIME
+from Code.label_search import MIN_TRANSFER_TIME, NO_ROUTE
+from Code.raptor import MAX_ROUNDS, NO_STOP, raptor_timetable, run_raptor
+
+'''
+Origin-destination matrices of earliest arrival and reliability.
+
+Every origin is one one-to-all RAPTOR sweep on the shared Timetable (no destination, so no target
+pruning), which yields the earliest arrival at every stop at once. The reliability of the earliest
+journey to every stop is accumulated along the journey pointers of the sweep, so no path has to be
+reconstructed. The arrivals and reliabilities are the ones raptor_search returns for the same pair.
+The origins are distributed over worker processes, each worker builds the route patterns once.
+'''
+
+# Per worker process: (RaptorTimetable, query parameters), set by _init_worker
+_worker_state = None
+
+
+def one_to_all(data, origin: int, start_time: int, time_budget: int, excluded=frozenset(),
+               transfer_probability=None, max_rounds: int = MAX_ROUNDS,
+               min_transfer_time: int = MIN_TRANSFER_TIME) -> tuple:
+    """
+    Earliest arrival and reliability from one origin to every stop.
+
+    Parameters:
+    - data (RaptorTimetable): Route patterns of the service day.
+    - origin (int): Stop index of the origin.
+    - start_time (int): Departure time at the origin in seconds.
+    - time_budget (int): Maximum travel time in seconds.
+    - excluded (set, optional): Route indices that must not be used.
+    - transfer_probability (callable, optional): Maps the transfer time in seconds to a probability.
+    - max_rounds (int): Maximum number of trips of a journey.
+    - min_transfer_time (int): Minimum time in seconds for a change between two routes.
+
+    Returns:
+    - tuple: (arrivals, reliabilities) as arrays over all stops, NO_TIME and 0.0 for unreachable stops.
+    """
+    _, parents, reached = run_raptor(data, origin, NO_STOP, start_time, time_budget, excluded,
+                                     max_rounds, min_transfer_time)
+    n_stops = len(data.stop_patterns)
+    arrivals = np.full(n_stops, NO_TIME, dtype=np.int32)
+    reliabilities = np.zeros(n_stops, dtype=np.float64)
+
+    # Reliability per (stop, route, round): the reliability at the boarding stop times the transfer probability there
+    reliability_of = {(origin, NO_ROUTE, 0): 1.0}
+
+    def reliability(stop, route, k):
+        chain = []
+        while (stop, route, k) not in reliability_of:
+            pattern_index, trip, boarding_position, _, boarding_round, boarding_route = parents[k][stop][route]
+            chain.append((stop, route, k, pattern_index, trip, boarding_position, boarding_round, boarding_route))
+            stop, route, k = data.patterns[pattern_index].stops[boarding_position], boarding_route, boarding_round
+        value = reliability_of[(stop, route, k)]
+        for stop, route, k, pattern_index, trip, boarding_position, boarding_round, boarding_route in reversed(chain):
+            pattern = data.patterns[pattern_index]
+            if boarding_round > 0 and transfer_probability is not None and boarding_route != pattern.route:
+                boarding_stop = pattern.stops[boarding_position]
+                previous_index, previous_trip, _, alighting_position, _, _ = parents[boarding_round][boarding_stop][boarding_route]
+                transfer_time = (pattern.departures[trip][boarding_position] -
+                                 data.patterns[previous_index].arrivals[previous_trip][alighting_position])
+                value *= transfer_probability(transfer_time)
+            reliability_of[(stop, route, k)] = value
+        return value
+
+    for stop, (time, route, k) in reached.items():
+        arrivals[stop] = time
+        reliabilities[stop] = 1.0 if route == NO_ROUTE else reliability(stop, route, k)
+    return arrivals, reliabilities
+
+
+def _init_worker(timetable, query):
+    global _worker_state
+    _worker_state = (raptor_timetable(timetable), query)
+
+
+def _sweep(origin: int) -> tuple:
+    data, query = _worker_state
+    return one_to_all(data, origin, *query)
+
+
+def od_matrix(timetable, origins, destinations=None, start_time: int = 0, time_budget: int = 24 * 3600,
+              excluded=frozenset(), transfer_probability=None, max_rounds: int = MAX_ROUNDS,
+              min_transfer_time: int = MIN_TRANSFER_TIME, workers: int = None) -> tuple:
+    """
+    Matrices of earliest arrival and reliability between origins and destinations.
+
+    Parameters:
+    - timetable (Timetable): Timetable of the service day.
+    - origins (list): Stop indices of the origins (rows).
+    - destinations (list, optional): Stop indices of the destinations (columns), all stops if not given.
+    - start_time (int): Departure time at every origin in seconds.
+    - time_budget (int): Maximum travel time in seconds.
+    - excluded (set, optional): Route indices that must not be used.
+    - transfer_probability (callable, optional): Maps the transfer time in seconds to a probability,
+      must be picklable (module level function) when more than one worker is used.
+    - max_rounds (int): Maximum number of trips of a journey.
+    - min_transfer_time (int): Minimum time in seconds for a change between two routes.
+    - workers (int, optional): Number of worker processes, all cores if not given, 1 runs in this process.
+
+    Returns:
+    - tuple: (arrivals, reliabilities) of shape (len(origins), len(destinations)), NO_TIME and 0.0
+      where the destination cannot be reached within the budget.
+    """
+    origins = list(origins)
+    columns = np.arange(timetable.n_stops) if destinations is None else np.asarray(destinations, dtype=np.int64)
+    arrivals = np.full((len(origins), len(columns)), NO_TIME, dtype=np.int32)
+    reliabilities = np.zeros((len(origins), len(columns)), dtype=np.float64)
+    query = (start_time, time_budget, frozenset(excluded), transfer_probability, max_rounds, min_transfer_time)
+
+    workers = min(workers or os.cpu_count() or 1, len(origins))
+    if workers <= 1:
+        data = raptor_timetable(timetable)
+        results = (one_to_all(data, origin, *query) for origin in origins)
+        for row, (origin_arrivals, origin_reliabilities) in enumerate(results):
+            arrivals[row] = origin_arrivals[columns]
+            reliabilities[row] = origin_reliabilities[columns]
+        return arrivals, reliabilities
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(timetable, query)) as pool:
+        chunksize = max(1, len(origins) // (4 * workers))
+        for row, (origin_arrivals, origin_reliabilities) in enumerate(pool.map(_sweep, origins, chunksize=chunksize)):
+            arrivals[row] = origin_arrivals[columns]
+            reliabilities[row] = origin_reliabilities[columns]
+    return arrivals, reliabilities
@@ -0,0 +1,388 @@
+from bisect import bisect_left
+from weakref import WeakKeyDictionary
+
+import numpy as np
+
+from Code.label_search import MIN_TRANSFER_TIME, NO_ROUTE
+
+'''
+Round-based public transit routing (RAPTOR) on route patterns.
+
+The connections of a Timetable are chained per trip and the trips are grouped into route
+patterns: trips of the same route serving the same stop sequence, sorted by departure and
+without overtaking. Round k scans every pattern through a stop improved in round k - 1 once,
+from the first improved stop to the end, so there is no priority queue. After round k the
+earliest arrival with at most k trips (k - 1 transfers) is known for every stop.
+
+Times are int seconds since the start of the service day, stops and routes are the indices of
+the Timetable, paths have the same format as label_setting_search.
+'''
+
+# Upper bound for the number of trips of a journey (rounds)
+MAX_ROUNDS = 10
+# Destination of a one-to-all sweep (no target pruning)
+NO_STOP = -1
+
+
+class RoutePattern:
+    """
+    Trips of one route with an identical stop sequence, in FIFO order.
+
+    Attributes:
+    - route (int): Route index.
+    - stops (list): Stop indices in travel order.
+    - trips (list): Trip index of every trip of the pattern.
+    - arrivals, departures (list): arrivals[t][i] / departures[t][i] of trip t at position i.
+    - departure_columns (list): departure_columns[i] lists the departures of all trips at position i (sorted).
+    """
+
+    def __init__(self, route, stops, trips, arrivals, departures):
+        self.route = route
+        self.stops = stops
+        self.trips = trips
+        self.arrivals = arrivals
+        self.departures = departures
+        self.departure_columns = [list(column) for column in zip(*departures)]
+
+    def earliest_trip(self, position: int, time: int) -> int:
+        # Index of the first trip departing at or after time at the given position (len(trips) if none)
+        return bisect_left(self.departure_columns[position], time)
+
+
+class RaptorTimetable:
+    """
+    Route patterns of a Timetable with the lookup stop -> (pattern, position).
+
+    Attributes:
+    - timetable (Timetable): The underlying timetable (names and ids).
+    - patterns (list): All RoutePatterns.
+    - stop_patterns (list): For every stop index a list of (pattern index, position).
+    """
+
+    def __init__(self, timetable):
+        self.timetable = timetable
+        self.patterns = []
+        self.stop_patterns = [[] for _ in range(timetable.n_stops)]
+
+        # Sort the connections by trip and departure, a trip chain breaks where a connection does
+        # not start at the stop the previous one arrived at (connections removed by the filters)
+        source = np.repeat(np.arange(timetable.n_stops, dtype=np.int32), np.diff(timetable.offsets))
+        order = np.lexsort((timetable.dep, timetable.trip))
+        source, target = source[order], timetable.target[order]
+        dep, arr = timetable.dep[order], timetable.arr[order]
+        trip, route = timetable.trip[order], timetable.route[order]
+        breaks = np.ones(len(order), dtype=bool)
+        breaks[1:] = (trip[1:] != trip[:-1]) | (source[1:] != target[:-1])
+        starts = np.flatnonzero(breaks).tolist()
+        ends = starts[1:] + [len(order)]
+
+        source, target, dep, arr = source.tolist(), target.tolist(), dep.tolist(), arr.tolist()
+        trip, route = trip.tolist(), route.tolist()
+        chains = {}
+        for lo, hi in zip(starts, ends):
+            stops = (source[lo],) + tuple(target[lo:hi])
+            # The departure at the last stop and the arrival at the first stop are never used
+            arrivals = [dep[lo]] + arr[lo:hi]
+            departures = dep[lo:hi] + [arr[hi - 1]]
+            chains.setdefault((route[lo], stops), []).append((departures, arrivals, trip[lo]))
+
+        for (route_index, stops), trips in chains.items():
+            trips.sort()
+            # Split into patterns without overtaking, so the earliest trip can be found by bisection
+            groups = []
+            for departures, arrivals, trip_index in trips:
+                for group in groups:
+                    last_departures, last_arrivals, _ = group[-1]
+                    if all(d >= ld for d, ld in zip(departures, last_departures)) and \
+                            all(a >= la for a, la in zip(arrivals, last_arrivals)):
+                        group.append((departures, arrivals, trip_index))
+                        break
+                else:
+                    groups.append([(departures, arrivals, trip_index)])
+
+            for group in groups:
+                pattern_index = len(self.patterns)
+                self.patterns.append(RoutePattern(route_index, list(stops), [t for _, _, t in group],
+                                                  [a for _, a, _ in group], [d for d, _, _ in group]))
+                for position, stop in enumerate(stops[:-1]):
+                    self.stop_patterns[stop].append((pattern_index, position))
+
+
+# Route patterns are built once per Timetable and reused for all queries on it
+_raptor_timetables = WeakKeyDictionary()
+
+
+def raptor_timetable(timetable) -> RaptorTimetable:
+    """
+    Returns the (cached) route patterns of a Timetable.
+
+    Parameters:
+    - timetable (Timetable): Timetable of the service day.
+
+    Returns:
+    - (RaptorTimetable): The route patterns.
+    """
+    if timetable not in _raptor_timetables:
+        _raptor_timetables[timetable] = RaptorTimetable(timetable)
+    return _raptor_timetables[timetable]
+
+
+def insert_label(stop_labels: tuple, time: int, route: int, round_index: int, min_transfer_time: int):
+    """
+    Adds an arrival to the labels of a stop unless one of them dominates it.
+
+    A label dominates the labels of its own route that arrive later, and the labels of other routes that arrive at
+    least min_transfer_time later (boarding the route a label arrived with needs no transfer time). The label of
+    the start (NO_ROUTE) boards every route without a transfer.
+
+    Parameters:
+    - stop_labels (tuple): (time, route, round) labels of the stop, sorted by time.
+    - time (int): Arrival time in seconds.
+    - route (int): Route index of the arrival.
+    - round_index (int): Round of the arrival.
+    - min_transfer_time (int): Minimum time in seconds for a change between two routes.
+
+    Returns:
+    - (tuple): The new labels of the stop sorted by time, None if the arrival is dominated.
+    """
+    for other_time, other_route, _ in stop_labels:
+        if other_time + min_transfer_time <= time or \
+                (other_time <= time and (other_route == route or other_route == NO_ROUTE)):
+            return None
+    kept = [label for label in stop_labels if label[1] != route and time + min_transfer_time > label[0]]
+    kept.append((time, route, round_index))
+    kept.sort()
+    return tuple(kept)
+
+
+def run_raptor(data: RaptorTimetable, start_stop: int, end_stop: int, start_time: int, time_budget: int,
+               excluded=frozenset(), max_rounds: int = MAX_ROUNDS,
+               min_transfer_time: int = MIN_TRANSFER_TIME) -> tuple:
+    """
+    Runs the RAPTOR rounds for one query.
+
+    Every stop keeps the non-dominated arrivals per incoming route (see insert_label), like the bags per
+    (stop, route) of label_setting_search: a later arrival with the route of the next trip can still catch it
+    when an earlier arrival with another route would miss it because of the transfer time. So the arrivals
+    are the ones of label_setting_search with the same min_transfer_time (up to max_rounds trips).
+
+    Parameters:
+    - data (RaptorTimetable): Route patterns of the service day.
+    - start_stop, end_stop (int): Stop indices of origin and destination.
+    - start_time (int): Departure time at the origin in seconds.
+    - time_budget (int): Maximum travel time in seconds.
+    - excluded (set, optional): Route indices that must not be used.
+    - max_rounds (int): Maximum number of trips of a journey.
+    - min_transfer_time (int): Minimum time in seconds for a change between two routes.
+
+    Returns:
+    - tuple: (target_arrivals, parents, reached) with target_arrivals[k] the earliest arrival at the
+      destination with at most k trips (None if not reachable), parents[k] the journey pointers of
+      round k (stop -> route -> (pattern, trip, boarding position, alighting position, boarding round,
+      boarding route)) and reached the earliest arrival of every reached stop (stop -> (time, route, round)).
+      Without a destination in the timetable (e.g. NO_STOP) the rounds are a one-to-all sweep.
+    """
+    latest_arrival = start_time + time_budget
+    # Non-dominated arrivals per stop over all rounds so far: stop -> ((time, route, round), ...) sorted by time,
+    # the labels of another route arrive less than min_transfer_time after the first one
+    labels = {start_stop: ((start_time, NO_ROUTE, 0),)}
+    # Earliest arrival per stop over all rounds so far: stop -> (time, route, round)
+    reached = {start_stop: (start_time, NO_ROUTE, 0)}
+    # Stops improved in the last round: stop -> None (new earliest arrival) or the routes of later labels
+    marked = {start_stop: None}
+    target_arrivals = [start_time if start_stop == end_stop else None]
+    parents = [{}]
+
+    for k in range(1, max_rounds + 1):
+        # Collect the patterns through the marked stops with their first marked position
+        queue = {}
+        for stop, routes in marked.items():
+            for pattern_index, position in data.stop_patterns[stop]:
+                if routes is not None and data.patterns[pattern_index].route not in routes:
+                    continue  # only the own route can use a label that is not the earliest arrival
+                if position < queue.get(pattern_index, len(data.patterns[pattern_index].stops)):
+                    queue[pattern_index] = position
+
+        # The labels of a stop are replaced, never changed in place, so a shallow copy keeps the previous rounds
+        previous = dict(labels)
+        parents_k = {}
+        marked = {}
+        for pattern_index, first_position in queue.items():
+            pattern = data.patterns[pattern_index]
+            pattern_route = pattern.route
+            if pattern_route in excluded:
+                continue
+            last_position = len(pattern.stops) - 1
+            trip = -1
+            for position in range(first_position, last_position + 1):
+                stop = pattern.stops[position]
+
+                # Alight: add the arrival with the current trip (local and target pruning)
+                if trip >= 0:
+                    arrival = pattern.arrivals[trip][position]
+                    target = reached.get(end_stop)
+                    if arrival <= latest_arrival and (target is None or arrival < target[0]):
+                        stop_labels = labels.get(stop)
+                        if stop_labels is None:
+                            stop_labels = ((arrival, pattern_route, k),)
+                        elif stop_labels[0][0] + min_transfer_time <= arrival:
+                            stop_labels = None  # dominated by the earliest arrival
+                        else:
+                            stop_labels = insert_label(stop_labels, arrival, pattern_route, k, min_transfer_time)
+                        if stop_labels is not None:
+                            labels[stop] = stop_labels
+                            best = reached.get(stop)
+                            if best is None or arrival < best[0]:
+                                reached[stop] = (arrival, pattern_route, k)
+                                marked[stop] = None
+                            elif marked.get(stop, ()) is not None:
+                                marked.setdefault(stop, set()).add(pattern_route)
+                            parents_k.setdefault(stop, {})[pattern_route] = (
+                                pattern_index, trip, boarding_position, position, boarding_round, boarding_route)
+
+                # Board: catch an earlier trip with the arrivals of the previous rounds
+                stop_labels = previous.get(stop)
+                if stop_labels is not None and position < last_position:
+                    ready, ready_route, ready_round = stop_labels[0]
+                    if ready_route != NO_ROUTE and ready_route != pattern_route:
+                        ready += min_transfer_time
+                        # A later arrival with this route needs no transfer time
+                        if len(stop_labels) > 1:
+                            for time, route, label_round in stop_labels:
+                                if route == pattern_route:
+                                    ready, ready_route, ready_round = time, route, label_round
+                                    break
+                    if trip < 0 or ready <= pattern.departures[trip][position]:
+                        earlier = pattern.earliest_trip(position, ready)
+                        if earlier < len(pattern.trips) and (trip < 0 or earlier < trip):
+                            trip, boarding_position = earlier, position
+                            boarding_round, boarding_route = ready_round, ready_route
+
+        parents.append(parents_k)
+        target_arrivals.append(reached[end_stop][0] if end_stop in reached else None)
+        if not marked:
+            break
+    return target_arrivals, parents, reached
+
+
+def raptor_path(data: RaptorTimetable, parents: list, end_stop: int, round_index: int, route: int = None) -> list:
+    """
+    Reconstructs the journey reaching a stop in a given round.
+
+    Parameters:
+    - data (RaptorTimetable): Route patterns of the service day.
+    - parents (list): Journey pointers returned by run_raptor.
+    - end_stop (int): Stop index of the destination.
+    - round_index (int): Round in which the destination was reached.
+    - route (int, optional): Route of the arrival, the earliest arrival of the round if not given.
+
+    Returns:
+    - (list): Alternating (stop, time) and (route, departure, arrival) tuples, one per connection.
+    """
+    if route is None:
+        pointers = parents[round_index][end_stop]
+        route = min(pointers, key=lambda r: data.patterns[pointers[r][0]].arrivals[pointers[r][1]][pointers[r][3]])
+
+    rides = []
+    stop, k = end_stop, round_index
+    while k > 0:
+        pattern_index, trip, boarding_position, alighting_position, boarding_round, boarding_route = parents[k][stop][route]
+        rides.append((data.patterns[pattern_index], trip, boarding_position, alighting_position))
+        stop, k, route = data.patterns[pattern_index].stops[boarding_position], boarding_round, boarding_route
+    rides.reverse()
+
+    path = []
+    for pattern, trip, boarding_position, alighting_position in rides:
+        if not path:
+            path.append((pattern.stops[boarding_position], None))
+        for position in range(boarding_position, alighting_position):
+            arrival = pattern.arrivals[trip][position + 1]
+            path.append((pattern.route, pattern.departures[trip][position], arrival))
+            path.append((pattern.stops[position + 1], arrival))
+    return path
+
+
+def path_reliability(path: list, transfer_probability=None, delay_model=None, timetable=None) -> float:
+    """
+    Reliability of a path: product of the transfer probabilities of all route changes.
+
+    Parameters:
+    - path (list): Alternating (stop, time) and (route, departure, arrival) tuples.
+    - transfer_probability (callable, optional): Maps the transfer time in seconds to a probability.
+    - delay_model (DelayModel, optional): Transfer curves used instead of transfer_probability.
+    - timetable (Timetable, optional): Timetable of the path indices, needed with a delay_model.
+
+    Returns:
+    - (float): Reliability of the path.
+    """
+    reliability = 1.0
+    if transfer_probability is None and delay_model is None:
+        return reliability
+    for i in range(3, len(path), 2):
+        previous_route, current_route = path[i - 2][0], path[i][0]
+        if previous_route != current_route:
+            # path[i - 1] is the (stop, arrival) of the transfer
+            transfer_time = path[i][1] - path[i - 1][1]
+            if delay_model is not None:
+                reliability *= delay_model.timetable_transfer_probability(
+                    timetable, previous_route, current_route, path[i - 1][0], transfer_time, path[i - 1][1])
+            else:
+                reliability *= transfer_probability(transfer_time)
+    return reliability
+
+
+def raptor_search(timetable, start_stop: int, end_stop: int, start_time: int, time_budget: int,
+                  excluded=frozenset(), transfer_probability=None, max_rounds: int = MAX_ROUNDS,
+                  min_transfer_time: int = MIN_TRANSFER_TIME, delay_model=None) -> tuple:
+    """
+    Earliest arrival query with RAPTOR, drop-in for label_setting_search.
+
+    Parameters:
+    - timetable (Timetable): Timetable of the service day.
+    - start_stop, end_stop (int): Stop indices of origin and destination.
+    - start_time (int): Departure time at the origin in seconds.
+    - time_budget (int): Maximum travel time in seconds.
+    - excluded (set, optional): Route indices that must not be used.
+    - transfer_probability (callable, optional): Maps the transfer time in seconds to a probability.
+    - max_rounds (int): Maximum number of trips of a journey.
+    - min_transfer_time (int): Minimum time in seconds for a change between two routes.
+    - delay_model (DelayModel, optional): Transfer curves per arriving route, departing route, stop and
+      hour, used instead of transfer_probability.
+
+    Returns:
+    - tuple: (arrival time, path, reliability), (inf, [], 0.0) if the destination is not reachable.
+    """
+    journeys = raptor_journeys(timetable, start_stop, end_stop, start_time, time_budget, excluded,
+                               transfer_probability, max_rounds, min_transfer_time, delay_model)
+    if not journeys:
+        return float("inf"), [], 0.0
+    # The last journey has the earliest arrival (with the fewest trips among equal arrivals)
+    _, arrival_time, path, reliability = journeys[-1]
+    return arrival_time, path, reliability
+
+
+def raptor_journeys(timetable, start_stop: int, end_stop: int, start_time: int, time_budget: int,
+                    excluded=frozenset(), transfer_probability=None, max_rounds: int = MAX_ROUNDS,
+                    min_transfer_time: int = MIN_TRANSFER_TIME, delay_model=None) -> list:
+    """
+    Pareto set over (number of trips, arrival time): one journey for every round that improved the arrival.
+
+    Parameters:
+    - Same as raptor_search.
+
+    Returns:
+    - (list): (trips, arrival time, path, reliability) tuples, fewest trips first.
+    """
+    if start_stop == end_stop:
+        return [(0, start_time, [(start_stop, start_time)], 1.0)]
+    data = raptor_timetable(timetable)
+    target_arrivals, parents, _ = run_raptor(data, start_stop, end_stop, start_time, time_budget, excluded,
+                                          max_rounds, min_transfer_time)
+    journeys = []
+    for k in range(1, len(target_arrivals)):
+        if end_stop in parents[k]:
+            path = raptor_path(data, parents, end_stop, k)
+            path[0] = (start_stop, start_time)
+            reliability = path_reliability(path, transfer_probability, delay_model, timetable)
+            journeys.append((k, target_arrivals[k], path, reliability))
+    return journeys
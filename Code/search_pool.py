@@ -0,0 +1,57 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+'''
+Process pool for independent searches on one read-only timetable.
+
+Where the platform can fork (Linux, macOS with the fork start method), the workers inherit the
+timetable from the parent process copy-on-write: nothing is pickled and the large NumPy arrays
+of a Timetable are never written, so their pages stay shared. Elsewhere every worker receives
+one pickled copy through the initializer. The results are returned in the order of the jobs,
+independent of which worker finished first.
+'''
+
+# (search, graph) of the current pool, inherited by forked workers or set by _init_worker
+_shared = None
+
+
+def _init_worker(search, graph):
+    global _shared
+    _shared = (search, graph)
+
+
+def _run(job: tuple):
+    search, graph = _shared
+    return search(graph, *job)
+
+
+def map_searches(search, graph, jobs: list, workers: int = None) -> list:
+    """
+    Runs search(graph, *job) for every job, in worker processes sharing the graph.
+
+    Parameters:
+    - search (callable): Search function taking the graph as first argument.
+    - graph: Read-only graph or timetable shared by all searches.
+    - jobs (list): Argument tuples of the searches (without the graph).
+    - workers (int, optional): Number of worker processes, all cores if not given, 1 runs in this process.
+
+    Returns:
+    - (list): The results in the order of the jobs.
+    """
+    global _shared
+    jobs = list(jobs)
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        return [search(graph, *job) for job in jobs]
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        _shared = (search, graph)  # Inherited copy-on-write by the forked workers
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as pool:
+                return list(pool.map(_run, jobs))
+        finally:
+            _shared = None
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(search, graph)) as pool:
+        return list(pool.map(_run, jobs))
@@ -0,0 +1,184 @@
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+'''
+Precomputed service calendar.
+
+calendar.txt and calendar_dates.txt are evaluated once into a boolean matrix with one row per
+service_id and one column per day of the feed period. "Is service s active on day d" is then a
+single array lookup, and the active trips of a day are found with one vectorized index operation
+instead of checking every trip against the calendar tables.
+
+calendar_dates follows the GTFS specification: exception_type 1 adds the service on that date,
+exception_type 2 removes it.
+
+shared_service_calendar builds the matrix once per pair of calendar tables and returns the same
+instance on every later call, so code that is only handed the DataFrames (e.g. one graph build
+per query) does not evaluate the calendar again.
+'''
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+SERVICE_ADDED = 1
+SERVICE_REMOVED = 2
+
+
+def to_date(day) -> date:
+    """
+    Converts the different date formats used in the code base into a date.
+
+    Parameters:
+    - day (date, datetime, str or int): Date as object, 'YYYY-MM-DD' / 'YYYYMMDD' string or GTFS int YYYYMMDD.
+
+    Returns:
+    - (date): The date.
+    """
+    if isinstance(day, datetime):
+        return day.date()
+    if isinstance(day, date):
+        return day
+    day = str(day).strip()
+    return datetime.strptime(day, "%Y-%m-%d" if "-" in day else "%Y%m%d").date()
+
+
+def gtfs_dates_to_ordinals(values) -> np.ndarray:
+    # GTFS dates (YYYYMMDD as int or string) -> proleptic Gregorian ordinals (date.toordinal())
+    dates = pd.to_datetime(pd.Series(values).astype(str), format="%Y%m%d")
+    return (dates - pd.Timestamp("0001-01-01")).dt.days.to_numpy(dtype=np.int64) + 1
+
+
+class ServiceCalendar:
+    """
+    Service x day activity matrix built from the GTFS calendar tables.
+
+    Attributes:
+    - service_ids (ndarray): service_id for every row of the matrix.
+    - service_index (pd.Index): Lookup of service_id -> row.
+    - first_day (int): Ordinal of the first day (column 0) of the matrix.
+    - active (ndarray): bool matrix, active[s, d] is True if service s runs on day first_day + d.
+    """
+
+    def __init__(self, calendar: pd.DataFrame, calendar_dates: pd.DataFrame):
+        self.service_ids = pd.unique(pd.concat([calendar["service_id"], calendar_dates["service_id"]],
+                                               ignore_index=True))
+        self.service_index = pd.Index(self.service_ids)
+
+        start = gtfs_dates_to_ordinals(calendar["start_date"])
+        end = gtfs_dates_to_ordinals(calendar["end_date"])
+        exception_days = gtfs_dates_to_ordinals(calendar_dates["date"])
+        all_days = np.concatenate([start, end, exception_days])
+        self.first_day = int(all_days.min()) if len(all_days) else 0
+        n_days = int(all_days.max()) - self.first_day + 1 if len(all_days) else 0
+        self.active = np.zeros((len(self.service_ids), n_days), dtype=bool)
+
+        # Regular service: inside [start_date, end_date] and on the flagged weekdays
+        days = self.first_day + np.arange(n_days)
+        weekday_of_day = (days - 1) % 7  # ordinal 1 (0001-01-01) is a monday
+        weekday_flags = calendar[WEEKDAYS].to_numpy(dtype=np.int64) == 1
+        in_period = (start[:, None] <= days[None, :]) & (days[None, :] <= end[:, None])
+        rows = self.service_index.get_indexer(calendar["service_id"])
+        self.active[rows] = in_period & weekday_flags[:, weekday_of_day]
+
+        # Exceptions overwrite the regular service
+        rows = self.service_index.get_indexer(calendar_dates["service_id"])
+        columns = exception_days - self.first_day
+        exception_type = calendar_dates["exception_type"].to_numpy()
+        added = exception_type == SERVICE_ADDED
+        removed = exception_type == SERVICE_REMOVED
+        self.active[rows[added], columns[added]] = True
+        self.active[rows[removed], columns[removed]] = False
+
+    @property
+    def n_days(self) -> int:
+        return self.active.shape[1]
+
+    def day_column(self, day):
+        # Column of the day in the matrix, None if the day is outside the feed period
+        column = to_date(day).toordinal() - self.first_day
+        return column if 0 <= column < self.n_days else None
+
+    def is_active(self, service_id, day) -> bool:
+        """
+        Checks whether a service runs on a given day.
+
+        Parameters:
+        - service_id: Service id as used in trips.txt.
+        - day (date, datetime or str): The service day.
+
+        Returns:
+        - (bool): True if the service is active on that day.
+        """
+        column = self.day_column(day)
+        row = self.service_index.get_indexer([service_id])[0]
+        return column is not None and row >= 0 and bool(self.active[row, column])
+
+    def active_services(self, day) -> set:
+        """
+        Returns all services running on a given day.
+
+        Parameters:
+        - day (date, datetime or str): The service day.
+
+        Returns:
+        - (set): service_ids of the active services.
+        """
+        column = self.day_column(day)
+        if column is None:
+            return set()
+        return set(self.service_ids[self.active[:, column]].tolist())
+
+    def active_mask(self, service_ids, day) -> np.ndarray:
+        """
+        Vectorized activity check for many service ids at once (e.g. the service_id column of trips).
+
+        Parameters:
+        - service_ids (array-like): Service ids, unknown ids count as inactive.
+        - day (date, datetime or str): The service day.
+
+        Returns:
+        - (ndarray): bool array with one entry per given service id.
+        """
+        rows = self.service_index.get_indexer(pd.Series(service_ids))
+        column = self.day_column(day)
+        if column is None or not len(self.service_ids):
+            return np.zeros(len(rows), dtype=bool)
+        return (rows >= 0) & self.active[rows, column]
+
+    def active_trips(self, trips: pd.DataFrame, day) -> np.ndarray:
+        """
+        Returns the trip_ids running on a given day.
+
+        Parameters:
+        - trips (DataFrame): GTFS trips with 'trip_id' and 'service_id'.
+        - day (date, datetime or str): The service day.
+
+        Returns:
+        - (ndarray): trip_ids of the active trips.
+        """
+        return trips["trip_id"].to_numpy()[self.active_mask(trips["service_id"], day)]
+
+
+# (calendar, calendar_dates, ServiceCalendar) of the tables seen last, the frames are kept so their ids stay unique
+_shared = None
+
+
+def shared_service_calendar(calendar: pd.DataFrame, calendar_dates: pd.DataFrame) -> ServiceCalendar:
+    """
+    Returns one ServiceCalendar per pair of calendar tables, built on the first call.
+
+    The tables are identified by object identity, so they must not be modified in place after the
+    first call (load new tables instead).
+
+    Parameters:
+    - calendar (DataFrame): GTFS calendar.
+    - calendar_dates (DataFrame): GTFS calendar_dates.
+
+    Returns:
+    - (ServiceCalendar): The shared matrix of these tables.
+    """
+    global _shared
+    if _shared is None or _shared[0] is not calendar or _shared[1] is not calendar_dates:
+        _shared = (calendar, calendar_dates, ServiceCalendar(calendar, calendar_dates))
+    return _shared[2]
@@ -0,0 +1,253 @@
+from bisect import bisect_left
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from Code.gtfs_time import NO_TIME, add_time_columns
+
+'''
+Compact, array-backed timetable.
+
+Stops, routes and trips are interned to dense integers. The connections between consecutive
+stops of a trip are stored in CSR form: all edges leaving stop s are found at positions
+offsets[s]:offsets[s + 1] of the edge arrays, sorted by departure time. Names are only needed
+at the API boundary (stop_index for the input, stop_names/route_ids for the output).
+'''
+
+
+def intern(values) -> tuple:
+    """
+    Maps arbitrary ids or names to dense integers.
+
+    Parameters:
+    - values (array-like): Values to intern.
+
+    Returns:
+    - tuple: (codes, uniques) with codes as int32 array and uniques as object array.
+    """
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=False)
+    return codes.astype(np.int32), np.asarray(uniques, dtype=object)
+
+
+class Timetable:
+    """
+    Timetable of one service day in CSR layout.
+
+    Attributes:
+    - stop_names (ndarray): Stop name for every stop index.
+    - stop_index (dict): Stop name -> stop index.
+    - route_ids (ndarray): Route id for every route index.
+    - trip_ids (ndarray): Trip id for every trip index.
+    - offsets (ndarray): Edges of stop s are offsets[s]:offsets[s + 1].
+    - target, dep, arr, route, trip (ndarray): Arrival stop, departure time, arrival time
+      (int32 seconds since the start of the service day), route index and trip index of every edge.
+    """
+
+    def __init__(self, stop_names, route_ids, trip_ids, source, target, dep, arr, route, trip):
+        self.stop_names = np.asarray(stop_names, dtype=object)
+        self.route_ids = np.asarray(route_ids, dtype=object)
+        self.trip_ids = np.asarray(trip_ids, dtype=object)
+        self.stop_index = {name: i for i, name in enumerate(self.stop_names)}
+        self.route_index = {route_id: i for i, route_id in enumerate(self.route_ids)}
+
+        # Sort all edges by departure stop and departure time, then build the row offsets
+        order = np.lexsort((dep, source))
+        source = np.asarray(source)[order]
+        self.target = np.asarray(target, dtype=np.int32)[order]
+        self.dep = np.asarray(dep)[order]
+        self.arr = np.asarray(arr)[order]
+        self.route = np.asarray(route, dtype=np.int32)[order]
+        self.trip = np.asarray(trip, dtype=np.int32)[order]
+        self.offsets = np.zeros(len(self.stop_names) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(source, minlength=len(self.stop_names)), out=self.offsets[1:])
+
+    @property
+    def n_stops(self) -> int:
+        return len(self.stop_names)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.target)
+
+    @property
+    def nbytes(self) -> int:
+        # Size of the edge arrays, the name tables are shared with the feed
+        return sum(a.nbytes for a in (self.offsets, self.target, self.dep, self.arr, self.route, self.trip))
+
+    def __contains__(self, stop_name) -> bool:
+        # A stop is part of the graph if it has outgoing connections (like the old dict graph)
+        s = self.stop_index.get(stop_name)
+        return s is not None and self.offsets[s + 1] > self.offsets[s]
+
+    def route_codes(self, route_ids) -> set:
+        """
+        Translates route ids into route indices, unknown routes are ignored.
+
+        Parameters:
+        - route_ids (iterable): Route ids as used in the GTFS feed.
+
+        Returns:
+        - (set): Route indices.
+        """
+        return {self.route_index[r] for r in route_ids if r in self.route_index}
+
+    def edges(self, stop: int) -> tuple:
+        """
+        Returns the outgoing edges of a stop as python lists.
+
+        Parameters:
+        - stop (int): Stop index.
+
+        Returns:
+        - tuple: (targets, departures, arrivals, routes) lists, sorted by departure time.
+        """
+        lo, hi = self.offsets[stop], self.offsets[stop + 1]
+        return (self.target[lo:hi].tolist(), self.dep[lo:hi].tolist(), self.arr[lo:hi].tolist(),
+                self.route[lo:hi].tolist())
+
+    def departures_after(self, stop: int, time: int) -> tuple:
+        """
+        Returns the outgoing edges of a stop departing at or after a given time.
+
+        The edges of a stop are sorted by departure time, so this is a binary search plus a
+        contiguous slice instead of a scan over all edges of the stop.
+
+        Parameters:
+        - stop (int): Stop index.
+        - time (int): Earliest departure time in seconds.
+
+        Returns:
+        - tuple: (targets, departures, arrivals, routes) lists, sorted by departure time.
+        """
+        lo, hi = self.offsets[stop], self.offsets[stop + 1]
+        lo += int(np.searchsorted(self.dep[lo:hi], time, side="left"))
+        return (self.target[lo:hi].tolist(), self.dep[lo:hi].tolist(), self.arr[lo:hi].tolist(),
+                self.route[lo:hi].tolist())
+
+
+class LegIndex:
+    """
+    Per-stop departure index over leg tuples as used by the MRIB/VRIB notebooks
+    (trip_id, departure_node, departure_time, arrival_node, arrival_time, route_id, service_id).
+
+    The legs of every departure node are stored in one contiguous block sorted by departure time,
+    the same layout as the edges of a Timetable.
+    """
+
+    def __init__(self, legs, node_position: int = 1, time_position: int = 2):
+        by_node = defaultdict(list)
+        for leg in legs:
+            by_node[leg[node_position]].append(leg)
+
+        self.legs = []
+        self.ranges = {}
+        for node, node_legs in by_node.items():
+            node_legs.sort(key=lambda leg: leg[time_position])
+            self.ranges[node] = (len(self.legs), len(self.legs) + len(node_legs))
+            self.legs.extend(node_legs)
+        self.departure_times = [leg[time_position] for leg in self.legs]
+
+    def __len__(self) -> int:
+        return len(self.legs)
+
+    def __iter__(self):
+        return iter(self.legs)
+
+    def departures_after(self, node, time) -> list:
+        """
+        Returns all legs leaving a node at or after a given time.
+
+        Parameters:
+        - node (str): Departure node.
+        - time (int): Earliest departure time.
+
+        Returns:
+        - (list): Legs sorted by departure time.
+        """
+        lo, hi = self.ranges.get(node, (0, 0))
+        return self.legs[bisect_left(self.departure_times, time, lo, hi):hi]
+
+
+def build_timetable(start_stop_names, end_stop_names, departures, arrivals, route_ids, trip_ids) -> Timetable:
+    """
+    Builds a Timetable from parallel sequences describing one connection each.
+
+    Parameters:
+    - start_stop_names, end_stop_names (array-like): Stop names of departure and arrival.
+    - departures, arrivals (array-like): Departure and arrival times in seconds (service day).
+    - route_ids, trip_ids (array-like): Route and trip of every connection.
+
+    Returns:
+    - (Timetable): The interned, CSR-ordered timetable.
+    """
+    n = len(start_stop_names)
+    stop_codes, stop_names = intern(np.concatenate([np.asarray(start_stop_names, dtype=object),
+                                                   np.asarray(end_stop_names, dtype=object)]))
+    route_codes, route_names = intern(route_ids)
+    trip_codes, trip_names = intern(trip_ids)
+    return Timetable(stop_names, route_names, trip_names, stop_codes[:n], stop_codes[n:],
+                     np.asarray(departures, dtype=np.int32), np.asarray(arrivals, dtype=np.int32),
+                     route_codes, trip_codes)
+
+
+def check_lookup(index: np.ndarray, keys, message: str):
+    # get_indexer returns -1 for unknown keys, which would silently select the last row
+    missing = index < 0
+    if missing.any():
+        unknown = pd.unique(np.asarray(keys, dtype=object)[missing])
+        raise ValueError(f"{len(unknown)} {message}: {', '.join(map(str, unknown[:10]))}")
+
+
+def build_timetable_from_stop_times(stop_times: pd.DataFrame, stops: pd.DataFrame, trips: pd.DataFrame,
+                                   active_trip_ids=None, start_seconds: int = None,
+                                   end_seconds: int = None) -> Timetable:
+    """
+    Builds the Timetable directly from GTFS stop_times without a per-trip loop.
+
+    The rows are sorted by trip and stop_sequence once, every row is then paired with the row
+    after it (like prepare_data does with shift(-1)). Service and time window filters are
+    applied as boolean masks before the pairing.
+
+    Parameters:
+    - stop_times (DataFrame): GTFS stop_times (with or without the integer time columns).
+    - stops (DataFrame): GTFS stops, used to map stop_id -> stop_name.
+    - trips (DataFrame): GTFS trips, used to map trip_id -> route_id.
+    - active_trip_ids (array-like, optional): Only these trips are used (e.g. ServiceCalendar.active_trips).
+    - start_seconds, end_seconds (int, optional): Time window, stop events with an arrival before
+      start_seconds or a departure after end_seconds are dropped.
+
+    Returns:
+    - (Timetable): The interned, CSR-ordered timetable.
+    """
+    stop_times = add_time_columns(stop_times)
+    arrival = stop_times["arrival_seconds"].to_numpy()
+    departure = stop_times["departure_seconds"].to_numpy()
+
+    mask = np.ones(len(stop_times), dtype=bool)
+    if active_trip_ids is not None:
+        mask &= stop_times["trip_id"].isin(active_trip_ids).to_numpy()
+    if start_seconds is not None:
+        mask &= arrival >= start_seconds
+    if end_seconds is not None:
+        mask &= departure <= end_seconds
+
+    rows = stop_times.loc[mask, ["trip_id", "stop_sequence", "stop_id"]]
+    rows = rows.assign(arrival_seconds=arrival[mask], departure_seconds=departure[mask])
+    rows = rows.sort_values(["trip_id", "stop_sequence"], kind="stable")
+
+    trip = rows["trip_id"].to_numpy()
+    arrival = rows["arrival_seconds"].to_numpy()
+    departure = rows["departure_seconds"].to_numpy()
+    stop_index = pd.Index(stops["stop_id"]).get_indexer(rows["stop_id"])
+    check_lookup(stop_index, rows["stop_id"], "stop_ids of stop_times missing in stops")
+    stop_name = stops["stop_name"].to_numpy()[stop_index]
+
+    # Connection i leads from row i to row i + 1 of the same trip
+    dep, arr = departure[:-1], arrival[1:]
+    valid = (trip[:-1] == trip[1:]) & (arr - dep > 0) & (dep != NO_TIME)
+    trip_ids = trip[:-1][valid]
+    trip_index = pd.Index(trips["trip_id"]).get_indexer(trip_ids)
+    check_lookup(trip_index, trip_ids, "trip_ids of stop_times missing in trips")
+    route_ids = trips["route_id"].to_numpy()[trip_index]
+    return build_timetable(stop_name[:-1][valid], stop_name[1:][valid], dep[valid], arr[valid], route_ids, trip_ids)
@@ -0,0 +1,400 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from weakref import WeakKeyDictionary
+
+import numpy as np
+
+from Code.import_data import read_string_table, write_string_table
+from Code.label_search import MIN_TRANSFER_TIME, NO_ROUTE
+from Code.raptor import MAX_ROUNDS, NO_STOP, path_reliability, raptor_timetable, run_raptor
+
+'''
+Transfer patterns: precomputed sequences of transfer stations between station pairs.
+
+Offline, every origin runs one one-to-all RAPTOR sweep per departure of the day. Every journey
+that is Pareto-optimal in (arrival time, number of trips) for some departure contributes its
+sequence of stations (origin, transfer stations, destination) to the transfer patterns of the
+pair. Every pattern extends the pattern of its last transfer station by one station, so the
+patterns of an origin form a prefix tree and are stored as one node (station, parent) each.
+The tree of one origin is written to its own file as soon as the origin is done, so an
+interrupted build resumes with the missing origins. Finally all trees are merged into one
+compact index (node arrays per origin plus the station names).
+
+A query only evaluates the patterns of its pair against the timetable of the day: every pair of
+consecutive stations of a pattern is a direct connection, the earliest trip serving it is found
+by bisection in the route patterns of RAPTOR. Stations are identified by their stop name, so one
+index serves the timetables of all days.
+'''
+
+# Raised when the computed patterns change, so the files of an older build are not resumed
+INDEX_VERSION = 2
+# Longest journey considered by the precomputation in seconds
+PATTERN_TIME_BUDGET = 6 * 3600
+
+MANIFEST_NAME = "manifest.json"
+STATIONS_NAME = "stations.strings.npy"
+INDEX_NAME = "transfer_patterns.npz"
+ORIGINS_DIR_NAME = "origins"
+
+NO_NODE = -1
+
+# Per worker process: (RaptorTimetables, station index, build parameters), set by _init_worker
+_worker_state = None
+
+
+def origin_transfer_patterns(data_list: list, station_index: dict, origin_name: str,
+                             time_budget: int = PATTERN_TIME_BUDGET, max_rounds: int = MAX_ROUNDS,
+                             min_transfer_time: int = MIN_TRANSFER_TIME) -> set:
+    """
+    Collects the transfer patterns of one origin over all departures of the given days.
+
+    Parameters:
+    - data_list (list): RaptorTimetables of the days the patterns are computed for.
+    - station_index (dict): Station name -> station id of the index.
+    - origin_name (str): Name of the origin station.
+    - time_budget (int): Longest journey considered in seconds.
+    - max_rounds (int): Maximum number of trips of a journey.
+    - min_transfer_time (int): Minimum time in seconds for a change between two routes.
+
+    Returns:
+    - (set): Tuples of station ids (origin, transfer stations..., destination).
+    """
+    patterns = set()
+    for data in data_list:
+        timetable = data.timetable
+        if origin_name not in timetable.stop_index:
+            continue
+        origin = timetable.stop_index[origin_name]
+        station_of = [station_index[name] for name in timetable.stop_names]
+
+        departures = set()
+        for pattern_index, position in data.stop_patterns[origin]:
+            departures.update(data.patterns[pattern_index].departure_columns[position])
+
+        for departure in sorted(departures):
+            _, parents, _ = run_raptor(data, origin, NO_STOP, departure, time_budget, max_rounds=max_rounds,
+                                       min_transfer_time=min_transfer_time)
+            # Station sequence per (stop, route, round), built from the sequence at the boarding stop
+            sequences = {(origin, NO_ROUTE, 0): (station_of[origin],)}
+            for k in range(1, len(parents)):
+                for stop, stop_parents in parents[k].items():
+                    for route, (pattern_index, _, boarding_position, _, boarding_round, boarding_route) in \
+                            stop_parents.items():
+                        boarding_stop = data.patterns[pattern_index].stops[boarding_position]
+                        sequence = sequences[(boarding_stop, boarding_route, boarding_round)] + (station_of[stop],)
+                        sequences[(stop, route, k)] = sequence
+                        patterns.add(sequence)
+    return patterns
+
+
+def _init_worker(timetables, stations, parameters):
+    global _worker_state
+    _worker_state = ([raptor_timetable(timetable) for timetable in timetables],
+                     {name: i for i, name in enumerate(stations)}, parameters)
+
+
+def _build_origin(job) -> int:
+    origin, origin_name, origins_dir = job
+    data_list, station_index, parameters = _worker_state
+    patterns = origin_transfer_patterns(data_list, station_index, origin_name, *parameters)
+    write_origin_file(origins_dir, origin, patterns)
+    return origin
+
+
+def write_origin_file(origins_dir: str, origin: int, patterns: set):
+    # Prefix tree of the patterns of one origin, the nodes sorted by station (the last station of
+    # their pattern) and the root first. Written under a temporary name and renamed when complete.
+    nodes = sorted(patterns | {(origin,)}, key=lambda pattern: (len(pattern) > 1, pattern[-1], len(pattern), pattern))
+    position = {pattern: i for i, pattern in enumerate(nodes)}
+    stations = np.array([pattern[-1] for pattern in nodes], dtype=np.int32)
+    parents = np.array([position[pattern[:-1]] if len(pattern) > 1 else NO_NODE for pattern in nodes],
+                       dtype=np.int32)
+    path = os.path.join(origins_dir, f"{origin}.npz")
+    with open(path + ".tmp", "wb") as f:
+        np.savez_compressed(f, stations=stations, parents=parents)
+    os.replace(path + ".tmp", path)
+
+
+def timetables_fingerprint(timetables) -> str:
+    """
+    Hash of the names and edges of the timetables a build is computed on.
+
+    Parameters:
+    - timetables (list): Timetables of the build.
+
+    Returns:
+    - (str): Hex digest, equal for timetables with the same stops, routes, trips and edges.
+    """
+    digest = hashlib.sha1()
+    for timetable in timetables:
+        for names in (timetable.stop_names, timetable.route_ids, timetable.trip_ids):
+            digest.update("\x1f".join(map(str, names)).encode("utf-8") + b"\x1e")
+        for array in (timetable.offsets, timetable.target, timetable.dep, timetable.arr, timetable.route,
+                      timetable.trip):
+            digest.update(np.asarray(array, dtype=np.int64).tobytes())
+        digest.update(b"\x1d")
+    return digest.hexdigest()
+
+
+def build_transfer_patterns(timetables, index_dir: str, origins=None, time_budget: int = PATTERN_TIME_BUDGET,
+                            max_rounds: int = MAX_ROUNDS, min_transfer_time: int = MIN_TRANSFER_TIME,
+                            workers: int = None, verbose: bool = True) -> str:
+    """
+    Precomputes the transfer patterns and writes the index, resuming an interrupted build.
+
+    Parameters:
+    - timetables (list): Timetables of the days the patterns are computed for (e.g. one per day type).
+    - index_dir (str): Directory of the index.
+    - origins (list, optional): Names of the origin stations, all stations if not given.
+    - time_budget (int): Longest journey considered in seconds.
+    - max_rounds (int): Maximum number of trips of a journey.
+    - min_transfer_time (int): Minimum time in seconds for a change between two routes.
+    - workers (int, optional): Number of worker processes, all cores if not given, 1 runs in this process.
+    - verbose (bool): Print the progress.
+
+    Returns:
+    - (str): Directory of the index.
+    """
+    stations = sorted({name for timetable in timetables for name in timetable.stop_names})
+    parameters = [time_budget, max_rounds, min_transfer_time]
+    origins_dir = os.path.join(index_dir, ORIGINS_DIR_NAME)
+    manifest_path = os.path.join(index_dir, MANIFEST_NAME)
+
+    # Files of an earlier build are only reused if it was started on the same timetables with the same
+    # stations and parameters
+    manifest = {"version": INDEX_VERSION, "stations": len(stations), "parameters": parameters,
+                "timetables": timetables_fingerprint(timetables)}
+    resume = False
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            previous = json.load(f)
+        resume = {key: previous.get(key) for key in manifest} == manifest and \
+            list(read_string_table(os.path.join(index_dir, STATIONS_NAME))[:-1]) == stations
+    os.makedirs(origins_dir, exist_ok=True)
+    if not resume:
+        for name in os.listdir(origins_dir):
+            os.remove(os.path.join(origins_dir, name))
+        write_string_table(os.path.join(index_dir, STATIONS_NAME), stations)
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+
+    station_index = {name: i for i, name in enumerate(stations)}
+    wanted = range(len(stations)) if origins is None else sorted(station_index[name] for name in origins
+                                                                 if name in station_index)
+    jobs = [(origin, stations[origin], origins_dir) for origin in wanted
+            if not os.path.exists(os.path.join(origins_dir, f"{origin}.npz"))]
+    if verbose:
+        print(f"transfer patterns: {len(wanted) - len(jobs)} of {len(wanted)} origins already done")
+
+    workers = min(workers or os.cpu_count() or 1, max(len(jobs), 1))
+    if workers <= 1:
+        _init_worker(timetables, stations, parameters)
+        done = map(_build_origin, jobs)
+        for i, _ in enumerate(done, 1):
+            if verbose and i % 100 == 0:
+                print(f"transfer patterns: {i} of {len(jobs)} origins computed")
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(timetables, stations, parameters)) as pool:
+            for i, _ in enumerate(pool.map(_build_origin, jobs), 1):
+                if verbose and i % 100 == 0:
+                    print(f"transfer patterns: {i} of {len(jobs)} origins computed")
+
+    merge_transfer_patterns(index_dir, len(stations))
+    return index_dir
+
+
+def merge_transfer_patterns(index_dir: str, n_stations: int):
+    """
+    Merges the files of all computed origins into the compact index.
+
+    Parameters:
+    - index_dir (str): Directory of the index.
+    - n_stations (int): Number of stations of the index.
+    """
+    origins_dir = os.path.join(index_dir, ORIGINS_DIR_NAME)
+    origin_offsets = np.zeros(n_stations + 1, dtype=np.int64)  # origin -> range of its tree nodes
+    node_stations, node_parents = [], []
+    n_nodes = 0
+    for origin in range(n_stations):
+        path = os.path.join(origins_dir, f"{origin}.npz")
+        if os.path.exists(path):
+            with np.load(path) as origin_file:
+                node_stations.append(origin_file["stations"])
+                node_parents.append(origin_file["parents"])
+            n_nodes += len(node_stations[-1])
+        origin_offsets[origin + 1] = n_nodes
+
+    empty = np.zeros(0, dtype=np.int32)
+    path = os.path.join(index_dir, INDEX_NAME)
+    with open(path + ".tmp", "wb") as f:
+        np.savez_compressed(f, origin_offsets=origin_offsets,
+                            node_stations=np.concatenate(node_stations) if node_stations else empty,
+                            node_parents=np.concatenate(node_parents) if node_parents else empty)
+    os.replace(path + ".tmp", path)
+
+
+# Direct connections per RaptorTimetable: (from stop, to stop) -> [(pattern, from position, to position)]
+_direct_connections = WeakKeyDictionary()
+
+
+class TransferPatternIndex:
+    """
+    Transfer patterns loaded from disk, with the query engine.
+
+    Attributes:
+    - stations (list): Station names, the position is the station id.
+    - station_index (dict): Station name -> station id.
+    - origin_offsets (np.ndarray): The tree of origin o has the nodes origin_offsets[o]:origin_offsets[o + 1].
+    - node_stations, node_parents (np.ndarray): Last station of the pattern of every node and the
+      parent node (position within the tree of the origin, NO_NODE for the root). Within a tree the
+      nodes are sorted by station after the root.
+    """
+
+    def __init__(self, index_dir: str):
+        self.stations = list(read_string_table(os.path.join(index_dir, STATIONS_NAME))[:-1])
+        self.station_index = {name: i for i, name in enumerate(self.stations)}
+        with np.load(os.path.join(index_dir, INDEX_NAME)) as index:
+            self.origin_offsets = index["origin_offsets"]
+            self.node_stations = index["node_stations"]
+            self.node_parents = index["node_parents"]
+
+    def __len__(self) -> int:
+        # Number of patterns (every node except the roots)
+        return len(self.node_stations) - int(np.count_nonzero(np.diff(self.origin_offsets)))
+
+    def patterns(self, origin_name: str, destination_name: str) -> list:
+        """
+        Transfer patterns between two stations.
+
+        Parameters:
+        - origin_name, destination_name (str): Station names.
+
+        Returns:
+        - (list): Tuples of station names (origin, transfer stations..., destination).
+        """
+        if origin_name not in self.station_index or destination_name not in self.station_index:
+            return []
+        origin, destination = self.station_index[origin_name], self.station_index[destination_name]
+        lo, hi = self.origin_offsets[origin], self.origin_offsets[origin + 1]
+        if lo == hi:
+            return []
+        stations, parents = self.node_stations[lo:hi], self.node_parents[lo:hi]
+        first = 1 + np.searchsorted(stations[1:], destination, side="left")
+        last = 1 + np.searchsorted(stations[1:], destination, side="right")
+        patterns = []
+        for node in range(first, last):
+            pattern = []
+            while node != NO_NODE:
+                pattern.append(self.stations[stations[node]])
+                node = parents[node]
+            patterns.append(tuple(reversed(pattern)))
+        return patterns
+
+    def search(self, timetable, start_stop: int, end_stop: int, start_time: int, time_budget: int,
+               excluded=frozenset(), transfer_probability=None,
+               min_transfer_time: int = MIN_TRANSFER_TIME, delay_model=None) -> tuple:
+        """
+        Earliest arrival query evaluating only the transfer patterns, drop-in for raptor_search.
+
+        Parameters:
+        - timetable (Timetable): Timetable of the service day.
+        - start_stop, end_stop (int): Stop indices of origin and destination.
+        - start_time (int): Departure time at the origin in seconds.
+        - time_budget (int): Maximum travel time in seconds.
+        - excluded (set, optional): Route indices that must not be used.
+        - transfer_probability (callable, optional): Maps the transfer time in seconds to a probability.
+        - min_transfer_time (int): Minimum time in seconds for a change between two routes.
+        - delay_model (DelayModel, optional): Transfer curves used instead of transfer_probability.
+
+        Returns:
+        - tuple: (arrival time, path, reliability), (inf, [], 0.0) if no pattern reaches the destination.
+        """
+        if start_stop == end_stop:
+            return start_time, [(start_stop, start_time)], 1.0
+        data = raptor_timetable(timetable)
+        latest_arrival = start_time + time_budget
+        best = None
+        for pattern in self.patterns(timetable.stop_names[start_stop], timetable.stop_names[end_stop]):
+            if any(name not in timetable.stop_index for name in pattern):
+                continue  # A station of the pattern is not served on this day
+            rides = evaluate_pattern(data, [timetable.stop_index[name] for name in pattern], start_time,
+                                     latest_arrival, excluded, min_transfer_time)
+            if rides is not None:
+                arrival = rides[-1][0].arrivals[rides[-1][1]][rides[-1][3]]
+                if best is None or (arrival, len(rides)) < best[:2]:
+                    best = (arrival, len(rides), rides)
+        if best is None:
+            return float("inf"), [], 0.0
+
+        path = [(start_stop, start_time)]
+        for pattern, trip, boarding_position, alighting_position in best[2]:
+            for position in range(boarding_position, alighting_position):
+                arrival = pattern.arrivals[trip][position + 1]
+                path.append((pattern.route, pattern.departures[trip][position], arrival))
+                path.append((pattern.stops[position + 1], arrival))
+        return best[0], path, path_reliability(path, transfer_probability, delay_model, timetable)
+
+
+def direct_connections(data, from_stop: int, to_stop: int) -> list:
+    """
+    Route patterns travelling directly from one stop to another.
+
+    Parameters:
+    - data (RaptorTimetable): Route patterns of the service day.
+    - from_stop, to_stop (int): Stop indices.
+
+    Returns:
+    - (list): (pattern, from position, to position) tuples.
+    """
+    cache = _direct_connections.setdefault(data, {})
+    key = (from_stop, to_stop)
+    if key not in cache:
+        connections = []
+        for pattern_index, position in data.stop_patterns[from_stop]:
+            pattern = data.patterns[pattern_index]
+            if to_stop in pattern.stops[position + 1:]:
+                connections.append((pattern, position, pattern.stops.index(to_stop, position + 1)))
+        cache[key] = connections
+    return cache[key]
+
+
+def evaluate_pattern(data, stops: list, start_time: int, latest_arrival: int, excluded=frozenset(),
+                     min_transfer_time: int = MIN_TRANSFER_TIME):
+    """
+    Earliest journey along a sequence of transfer stops, one trip per consecutive pair.
+
+    Parameters:
+    - data (RaptorTimetable): Route patterns of the service day.
+    - stops (list): Stop indices of the pattern (origin, transfer stops..., destination).
+    - start_time (int): Departure time at the origin in seconds.
+    - latest_arrival (int): Latest arrival in seconds.
+    - excluded (set, optional): Route indices that must not be used.
+    - min_transfer_time (int): Minimum time in seconds for a change between two routes.
+
+    Returns:
+    - (list): (pattern, trip, boarding position, alighting position) per ride, None if the
+      pattern cannot be travelled within the time.
+    """
+    time, last_route, rides = start_time, NO_ROUTE, []
+    for from_stop, to_stop in zip(stops[:-1], stops[1:]):
+        best = None
+        for pattern, from_position, to_position in direct_connections(data, from_stop, to_stop):
+            if pattern.route in excluded:
+                continue
+            ready = time
+            if last_route != NO_ROUTE and last_route != pattern.route:
+                ready += min_transfer_time
+            trip = pattern.earliest_trip(from_position, ready)
+            if trip < len(pattern.trips):
+                arrival = pattern.arrivals[trip][to_position]
+                if best is None or arrival < best[0]:
+                    best = (arrival, (pattern, trip, from_position, to_position))
+        if best is None or best[0] > latest_arrival:
+            return None
+        arrival, ride = best
+        rides.append(ride)
+        time, last_route = arrival, ride[0].route
+    return rides
@@ -0,0 +1,93 @@
+from functools import lru_cache
+
+import numpy as np
+import scipy.stats as stats
+
+'''
+Tabulated transfer probabilities.
+
+The transfer models are Gamma CDFs of the transfer time in minutes, optionally capped (MRIB and
+VRIB cap at 0.95). Evaluating stats.gamma.cdf costs tens of microseconds per call, which is paid
+on every transfer relaxation of a search. The table holds the probability for every full second
+of transfer time up to MAX_TRANSFER_SECONDS, so a lookup of an integer transfer time (all times
+of the timetables are int seconds) returns exactly the value of the CDF, fractional seconds are
+interpolated linearly. Longer transfers get the last value, negative ones the value at zero.
+
+Tables are shared: transfer_probability_table returns the same instance for the same model, so
+all engines using a model look up the same arrays.
+'''
+
+# Transfer times beyond this are treated like this one (the CDFs are 1 or at the cap long before)
+MAX_TRANSFER_SECONDS = 4 * 3600
+
+
+class TransferProbabilityTable:
+    """
+    Transfer probability per second of transfer time.
+
+    Attributes:
+    - shape, scale_minutes (float): Parameters of the Gamma distribution (scale in minutes).
+    - cap (float): Upper limit of the probability, None if not capped.
+    - values (np.ndarray): Probability for 0, 1, ..., MAX_TRANSFER_SECONDS seconds.
+    """
+
+    def __init__(self, shape: float, scale_minutes: float, cap: float = None,
+                 max_seconds: int = MAX_TRANSFER_SECONDS):
+        self.shape = shape
+        self.scale_minutes = scale_minutes
+        self.cap = cap
+        self.seconds = np.arange(max_seconds + 1)
+        self.values = stats.gamma.cdf(self.seconds / 60, a=shape, scale=scale_minutes)
+        if cap is not None:
+            self.values = np.minimum(self.values, cap)
+        self.values.setflags(write=False)
+        # Python floats for the scalar lookup, indexing a list is much cheaper than a NumPy array
+        self._values = self.values.tolist()
+        self._max_seconds = max_seconds
+
+    def __call__(self, transfer_seconds) -> float:
+        """
+        Probability of a single transfer.
+
+        Parameters:
+        - transfer_seconds (int or float): Transfer time in seconds.
+
+        Returns:
+        - (float): Probability of catching the connection.
+        """
+        if transfer_seconds <= 0:
+            return self._values[0]
+        if transfer_seconds >= self._max_seconds:
+            return self._values[-1]
+        i = int(transfer_seconds)
+        fraction = transfer_seconds - i
+        if fraction == 0:
+            return self._values[i]
+        return self._values[i] + (self._values[i + 1] - self._values[i]) * fraction
+
+    def probabilities(self, transfer_seconds) -> np.ndarray:
+        """
+        Probabilities of many transfers at once.
+
+        Parameters:
+        - transfer_seconds (array-like): Transfer times in seconds.
+
+        Returns:
+        - (np.ndarray): Probability for every transfer time.
+        """
+        return np.interp(np.asarray(transfer_seconds, dtype=np.float64), self.seconds, self.values)
+
+
+@lru_cache(maxsize=None)
+def transfer_probability_table(shape: float, scale_minutes: float, cap: float = None) -> TransferProbabilityTable:
+    """
+    Shared table of a transfer model, built once per process.
+
+    Parameters:
+    - shape, scale_minutes (float): Parameters of the Gamma distribution (scale in minutes).
+    - cap (float, optional): Upper limit of the probability.
+
+    Returns:
+    - (TransferProbabilityTable): The table of the model.
+    """
+    return TransferProbabilityTable(shape, scale_minutes, cap)